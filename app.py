@@ -1,17 +1,43 @@
 """
 教材プラットフォーム - Flaskメインアプリケーション
 """
-from flask import Flask, render_template, jsonify, request, send_from_directory
+from flask import Flask, render_template, jsonify, request, send_from_directory, send_file
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
 import config
-from lib.room_manager import room_manager, Participant, Annotation
+from lib.room_manager import room_manager, Participant, Annotation, StrokeSession
+from lib.stroke_codec import normalize_points, pack_points
 from lib.feedback_manager import feedback_manager, Feedback
+from lib.material_store import material_store
+from lib.search_index import search_index
+from lib.conversion_jobs import conversion_queue
+from lib.asset_store import asset_store
+from lib.presence import presence_batcher
+from lib.rate_limiter import rate_limiter
+from lib.latency import latency_tracker, server_timestamp
+from lib.lecture_recorder import lecture_recorder
+from lib.admin_metrics import admin_metrics
+from lib.deck_bundle import get_bundle, get_precache
+from lib.event_log import setup_logging, log_event
+from lib.profiler import profiler
+from lib.fanout import shard_fanout
+from lib.pdf_processor import material_id_from_filename, load_manifest_file, check_manifest
 from pathlib import Path
+from urllib.parse import unquote
+import functools
+import hmac
 import json
+import logging
+import math
+import os
+import threading
+import time
 import uuid
 from datetime import datetime
 
+# 構造化ログ（書き出しは別スレッド）
+setup_logging()
+
 # Flaskアプリ初期化
 app = Flask(__name__)
 app.config.from_object(config)
@@ -43,11 +69,10 @@ def instructor_view(room_id):
     
     # ルームが存在しない場合はデフォルト教材で作成
     if not room:
-        print(f"ルーム {room_id} が存在しないため、デフォルト教材で作成します")
         default_material_id = "⑧鉄筋工事１"
         instructor_id = "default_instructor"
         room = room_manager.create_room(room_id, default_material_id, instructor_id)
-        print(f"ルーム作成完了: {room_id}, 教材: {default_material_id}")
+        log_event("room:auto_created", room_id=room_id, material_id=default_material_id)
     
     material_id = room.material_id if room else None
     return render_template("instructor.html", room_id=room_id, material_id=material_id)
@@ -79,11 +104,10 @@ def debug_instructor(room_id):
     
     # ルームが存在しない場合はデフォルト教材で作成
     if not room:
-        print(f"デバッグ: ルーム {room_id} が存在しないため、デフォルト教材で作成します")
         default_material_id = "⑧鉄筋工事１"
         instructor_id = "debug_instructor"
         room = room_manager.create_room(room_id, default_material_id, instructor_id)
-        print(f"デバッグ: ルーム作成完了: {room_id}, 教材: {default_material_id}")
+        log_event("room:auto_created", room_id=room_id, material_id=default_material_id, debug=True)
     
     material_id = room.material_id if room else None
     return render_template("debug_instructor.html", room_id=room_id, material_id=material_id)
@@ -107,6 +131,15 @@ def feedback_analytics_view():
     return render_template("feedback_analytics.html")
 
 
+@app.route("/assets/<path:filename>")
+def serve_asset(filename):
+    """アセットストア配信（URLが内容ハッシュなので無期限キャッシュ可）"""
+    response = send_from_directory(asset_store.root_dir, filename, max_age=config.ASSET_CACHE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
 # ========================================
 # API Routes
 # ========================================
@@ -118,20 +151,182 @@ def get_materials():
     return jsonify(manifest)
 
 
+@app.route("/api/materials", methods=["POST"])
+def upload_material():
+    """
+    教材アップロードAPI
+    
+    リクエストボディにPDFをそのまま送る（Content-Type: application/pdf、
+    ファイル名はX-FilenameヘッダにURLエンコードして指定）。
+    ボディはチャンク単位でディスクに書き出し、変換はジョブキューに投入する。
+    """
+    filename = Path(unquote(request.headers.get("X-Filename", ""))).name
+    
+    if not filename.lower().endswith(".pdf"):
+        return jsonify({"error": "PDF filename is required"}), 400
+    
+    material_id = material_id_from_filename(filename)
+    if not material_store.is_valid_id(material_id):
+        return jsonify({"error": "Invalid filename"}), 400
+    
+    if request.content_length and request.content_length > config.UPLOAD_MAX_BYTES:
+        return jsonify({"error": "File too large"}), 413
+    
+    # 既存教材の上書き・同じ教材の並行変換はしない（講義中の教材を壊さないため）
+    if material_exists(material_id):
+        return jsonify({"error": "Material already exists"}), 409
+    
+    pdf_path = config.UPLOADS_DIR / filename
+    part_path = config.UPLOADS_DIR / f".{uuid.uuid4().hex}.part"
+    
+    try:
+        received = save_upload_stream(request.stream, part_path)
+    except UploadError as e:
+        part_path.unlink(missing_ok=True)
+        return jsonify({"error": str(e)}), e.status
+    
+    # 確認・PDFの配置・投入はまとめて行う（同名の並行アップロードが投入済みのPDFを上書きしないよう）
+    with upload_lock:
+        if material_exists(material_id):
+            part_path.unlink(missing_ok=True)
+            return jsonify({"error": "Material already exists"}), 409
+        
+        os.replace(part_path, pdf_path)
+        job = conversion_queue.submit(pdf_path, material_id)
+        if not job:
+            pdf_path.unlink(missing_ok=True)
+    
+    if not job:
+        return jsonify({"error": "Conversion queue is full"}), 503
+    
+    log_event("upload:accepted", filename=filename, bytes=received, job_id=job.id)
+    
+    return jsonify({"job": job.to_dict()}), 202
+
+
+@app.route("/api/materials/jobs")
+def get_conversion_jobs():
+    """変換ジョブ一覧API"""
+    return jsonify({"jobs": conversion_queue.get_all_jobs()})
+
+
+@app.route("/api/materials/jobs/<job_id>")
+def get_conversion_job(job_id):
+    """変換ジョブ状態API"""
+    job = conversion_queue.get_job(job_id)
+    
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    
+    return jsonify(job.to_dict())
+
+
 @app.route("/api/materials/<material_id>")
 def get_material(material_id):
     """教材詳細API"""
-    metadata_path = config.MATERIALS_DIR / material_id / "metadata.json"
+    metadata = material_store.get_metadata(material_id)
     
-    if not metadata_path.exists():
+    if not metadata:
         return jsonify({"error": "Material not found"}), 404
     
-    with open(metadata_path, "r", encoding="utf-8") as f:
-        metadata = json.load(f)
-    
     return jsonify(metadata)
 
 
+@app.route("/api/materials/<material_id>/summary")
+def get_material_summary(material_id):
+    """教材要約API（ページごとの本文を除いたタイトル・画像URL一覧）"""
+    summary = material_store.get_summary(material_id)
+    
+    if not summary:
+        return jsonify({"error": "Material not found"}), 404
+    
+    return jsonify(summary)
+
+
+@app.route("/api/materials/<material_id>/pages/<int:page_number>")
+def get_material_page(material_id, page_number):
+    """ページ詳細API（ノート・用語・チェックリスト・ハイライト）"""
+    page = material_store.get_page(material_id, page_number)
+    
+    if not page:
+        return jsonify({"error": "Page not found"}), 404
+    
+    return jsonify(page)
+
+
+@app.route("/api/materials/<material_id>/preload")
+def get_material_preload(material_id):
+    """教材先読みマニフェストAPI（?from=開始ページ）"""
+    start_page = request.args.get("from", 1, type=int)
+    manifest = material_store.get_preload_manifest(material_id, start_page)
+    
+    if not manifest:
+        return jsonify({"error": "Material not found"}), 404
+    
+    return jsonify(manifest)
+
+
+@app.route("/api/materials/<material_id>/precache")
+def get_material_precache(material_id):
+    """事前キャッシュ用マニフェストAPI（全アセットのURL・ハッシュ・サイズ）"""
+    metadata = material_store.get_metadata(material_id)
+    
+    if not metadata:
+        return jsonify({"error": "Material not found"}), 404
+    
+    precache = get_precache(config.MATERIALS_DIR / material_id, metadata)
+    if not precache:
+        return jsonify({"error": "Material is still converting"}), 409
+    
+    return jsonify(precache)
+
+
+@app.route("/api/materials/<material_id>/bundle")
+def get_material_bundle(material_id):
+    """
+    教材バンドルAPI（全ページ画像の無圧縮zip、初回リクエストで生成）
+    
+    Rangeリクエストに対応するので、クライアントは分割・再開しながら取得できる。
+    """
+    metadata = material_store.get_metadata(material_id)
+    
+    if not metadata:
+        return jsonify({"error": "Material not found"}), 404
+    
+    bundle_path = get_bundle(config.MATERIALS_DIR / material_id, metadata)
+    if not bundle_path:
+        return jsonify({"error": "Material is still converting"}), 409
+    
+    response = send_file(
+        bundle_path,
+        mimetype="application/zip",
+        as_attachment=True,
+        download_name=f"{material_id}.zip",
+        conditional=True
+    )
+    response.headers["Accept-Ranges"] = "bytes"
+    return response
+
+
+@app.route("/api/search")
+def search_materials():
+    """全文検索API（?q=検索語&limit=件数）"""
+    query = request.args.get("q", "").strip()
+    limit = max(1, min(request.args.get("limit", config.SEARCH_RESULT_LIMIT, type=int), 100))
+    
+    if not query:
+        return jsonify({"error": "Query is required"}), 400
+    
+    started = time.perf_counter()
+    hits = search_index.search(query, limit)
+    
+    return jsonify({
+        "query": query,
+        "hits": hits,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2)
+    })
+
+
 @app.route("/api/rooms", methods=["POST"])
 def create_room():
     """ルーム作成API"""
@@ -157,7 +352,7 @@ def get_room(room_id):
     if not room:
         return jsonify({"error": "Room not found"}), 404
     
-    return jsonify(room.get_state())
+    return jsonify(room.get_state(binary=False))
 
 
 @app.route("/api/rooms")
@@ -167,6 +362,35 @@ def get_all_rooms():
     return jsonify({"rooms": rooms})
 
 
+@app.route("/api/rooms/<room_id>/recording")
+def get_room_recording(room_id):
+    """講義記録の情報API（記録の開始・終了時刻）"""
+    recording = lecture_recorder.get_recording(room_id)
+    info = recording.info() if recording else None
+    
+    if not info:
+        return jsonify({"error": "Recording not found"}), 404
+    
+    return jsonify({"room_id": room_id, **info})
+
+
+@app.route("/api/rooms/<room_id>/recording/state")
+def get_room_recording_state(room_id):
+    """講義記録のシークAPI（?t=エポックミリ秒 時点のページ・注釈・重要ポイント）"""
+    t = request.args.get("t", type=int)
+    recording = lecture_recorder.get_recording(room_id)
+    
+    if t is None:
+        return jsonify({"error": "t is required"}), 400
+    
+    result = recording.seek(t) if recording else None
+    if not result:
+        return jsonify({"error": "Recording not found"}), 404
+    
+    state, _ = result
+    return jsonify({"room_id": room_id, "t": t, "state": state})
+
+
 @app.route("/api/feedback", methods=["GET", "POST"])
 def handle_feedback():
     """フィードバックAPI"""
@@ -194,6 +418,7 @@ def handle_feedback():
         )
         
         feedback_manager.add_feedback(feedback)
+        admin_metrics.add_feedback(feedback.to_dict())
         
         return jsonify({"success": True, "id": feedback.id})
     
@@ -212,35 +437,155 @@ def get_feedback_statistics():
 
 @app.route("/api/feedback/analytics")
 def get_feedback_analytics():
-    """フィードバック分析API（統計と同じ）"""
+    """フィードバック分析API（統計＋実測の同期遅延と同期速度評価の対応）"""
     stats = feedback_manager.get_statistics()
+    stats["latency_correlation"] = latency_tracker.correlate_with_feedback(
+        feedback_manager.get_all_feedbacks()
+    )
     return jsonify(stats)
 
 
+@app.route("/api/telemetry/latency")
+def get_latency_stats():
+    """同期遅延ヒストグラムAPI（全ルーム）"""
+    return jsonify({"rooms": latency_tracker.get_all_stats()})
+
+
+@app.route("/api/telemetry/latency/<room_id>")
+def get_room_latency_stats(room_id):
+    """同期遅延ヒストグラムAPI（ルーム別）"""
+    stats = latency_tracker.get_room_stats(room_id)
+    
+    if stats is None:
+        return jsonify({"error": "No latency data"}), 404
+    
+    return jsonify({"room_id": room_id, "events": stats})
+
+
+def require_admin_token(view):
+    """診断API用の管理トークン確認（X-Admin-Tokenヘッダ、ADMIN_TOKEN未設定なら常に拒否）"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = request.headers.get("X-Admin-Token", "")
+        if not config.ADMIN_TOKEN or not hmac.compare_digest(token, config.ADMIN_TOKEN):
+            return jsonify({"error": "Forbidden"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@app.route("/api/admin/profile", methods=["POST"])
+@require_admin_token
+def start_profile():
+    """プロファイル開始API（?seconds=採取秒数）"""
+    seconds = min(request.args.get("seconds", 10, type=float), config.PROFILER_MAX_SECONDS)
+    
+    if seconds <= 0:
+        return jsonify({"error": "seconds must be positive"}), 400
+    
+    if not profiler.start(seconds):
+        return jsonify({"error": "Profile already running", **profiler.status()}), 409
+    
+    log_event("profiler:started", seconds=seconds)
+    return jsonify(profiler.status()), 202
+
+
+@app.route("/api/admin/profile")
+@require_admin_token
+def get_profile():
+    """
+    プロファイル結果API
+    
+    実行中は状態をJSONで返し、終了後はcollapsed形式のテキストを返す
+    （flamegraph.pl・speedscopeでそのまま読める）
+    """
+    status = profiler.status()
+    
+    if status["started_at"] is None:
+        return jsonify({"error": "No profile"}), 404
+    
+    if status["running"]:
+        return jsonify(status), 202
+    
+    return app.response_class(profiler.collapsed(), mimetype="text/plain")
+
+
+@app.route("/api/admin/profile", methods=["DELETE"])
+@require_admin_token
+def stop_profile():
+    """プロファイル打ち切りAPI（それまでの結果は取得できる）"""
+    profiler.stop()
+    return jsonify(profiler.status())
+
+
 # ========================================
 # WebSocket Events
 # ========================================
 
+def rate_limited(event, coalesce=None):
+    """
+    接続ごとのレート制限
+    
+    制限を超えたイベントは破棄する。coalesce(sid, data)を指定した場合は
+    最新の1件だけ保留し、トークンが貯まった時点でcoalesceに渡す。
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(data=None):
+            sid = request.sid
+            admin_metrics.count_event(data.get("room_id") if isinstance(data, dict) else None)
+            if rate_limiter.allow(sid, event):
+                return handler(data)
+            
+            log_event("rate:limited", sid=sid, socket_event=event)
+            if coalesce and rate_limiter.defer(sid, event, data):
+                socketio.start_background_task(flush_deferred_event, sid, event, coalesce)
+        return wrapper
+    return decorator
+
+
+@socketio.on("connect", namespace="/admin")
+def handle_admin_connect():
+    """管理画面接続（変換進捗・ルーム状況の受信用）"""
+    admin_metrics.admin_connected()
+    emit("conversion:jobs", {"jobs": conversion_queue.get_all_jobs()})
+    if admin_metrics.last_rooms is not None:
+        emit("admin:rooms", {"rooms": admin_metrics.last_rooms})
+
+
+@socketio.on("disconnect", namespace="/admin")
+def handle_admin_disconnect():
+    """管理画面切断"""
+    admin_metrics.admin_disconnected()
+
+
 @socketio.on("connect")
 def handle_connect():
     """クライアント接続"""
-    print(f"Client connected: {request.sid}")
+    log_event("client:connected", sid=request.sid)
     emit("connected", {"sid": request.sid})
 
 
 @socketio.on("disconnect")
 def handle_disconnect():
     """クライアント切断"""
-    print(f"Client disconnected: {request.sid}")
+    log_event("client:disconnected", sid=request.sid)
+    rate_limiter.forget(request.sid)
+    replay_sessions.pop(request.sid, None)
+    downgraded_sids.discard(request.sid)
     
     # 全ルームから削除
-    for room in room_manager.rooms.values():
+    for room in list(room_manager.rooms.values()):
         if request.sid in room.participants:
             room.remove_participant(request.sid)
-            emit("participant:left", {"id": request.sid}, room=room.room_id)
+            presence_batcher.left(room.room_id, request.sid)
+        
+        # 描画中のストロークは再接続を待ってから確定する
+        if any(s.owner_sid == request.sid for s in room.active_strokes.values()):
+            socketio.start_background_task(expire_orphan_strokes, room.room_id)
 
 
 @socketio.on("room:join")
+@rate_limited("room:join")
 def handle_room_join(data):
     """ルーム参加"""
     room_id = data.get("room_id")
@@ -253,9 +598,6 @@ def handle_room_join(data):
         emit("error", {"message": "Room not found"})
         return
     
-    # ルーム参加
-    join_room(room_id)
-    
     # 参加者追加
     participant = Participant(
         id=request.sid,
@@ -263,57 +605,110 @@ def handle_room_join(data):
         role=role,
         joined_at=datetime.now().isoformat()
     )
-    room.add_participant(participant)
+    shard = room.shard_name(room.add_participant(participant))
+    
+    # 割り当てられたシャードに参加（描画中ストロークは配信用サブルームで受け取る）
+    join_room(shard)
+    join_room(live_room(shard))
+    
+    # 現在状態を送信（途中参加対応、受講者には参加者一覧を送らない）
+    state = room.get_state(include_participants=(role == "instructor"))
+    state["prefetch"] = material_store.get_prefetch_hints(room.material_id, room.current_page)
+    state["telemetry"] = {
+        "sample_rate": config.LATENCY_SAMPLE_RATE,
+        "batch_size": config.LATENCY_BATCH_SIZE,
+        "flush_interval": config.LATENCY_FLUSH_INTERVAL
+    }
+    emit("room:state", state)
+    
+    # 他の参加者への通知はflush_presenceでまとめて送る
+    presence_batcher.joined(room_id, participant.to_dict())
+    
+    log_event("room:joined", room_id=room_id, sid=request.sid, role=role)
+
+
+@socketio.on("latency:ping")
+@rate_limited("latency:ping")
+def handle_latency_ping(data):
+    """時計合わせ（ackでクライアント送信時刻とサーバー時刻を返す）"""
+    return {"client_ts": (data or {}).get("client_ts"), "server_ts": server_timestamp()}
+
+
+@socketio.on("latency:report")
+@rate_limited("latency:report")
+def handle_latency_report(data):
+    """クライアントの受信・描画時刻サンプルを集計"""
+    room_id = data.get("room_id")
+    samples = data.get("samples")
     
-    # 現在状態を送信（途中参加対応）
-    emit("room:state", room.get_state())
+    room = room_manager.get_room(room_id)
     
-    # 他の参加者に通知
-    emit("participant:joined", participant.to_dict(), room=room_id, skip_sid=request.sid)
+    if not room or request.sid not in room.participants:
+        return
     
-    print(f"Participant joined: {name} ({role}) in room {room_id}")
+    if isinstance(samples, list):
+        latency_tracker.record_samples(room_id, samples)
 
 
 @socketio.on("room:leave")
+@rate_limited("room:leave")
 def handle_room_leave(data):
     """ルーム退出"""
     room_id = data.get("room_id")
     
     room = room_manager.get_room(room_id)
     if room:
+        shard = room.shard_of(request.sid)
         room.remove_participant(request.sid)
-        leave_room(room_id)
-        emit("participant:left", {"id": request.sid}, room=room_id)
+        if shard:
+            leave_room(shard)
+            leave_room(live_room(shard))
+        presence_batcher.left(room_id, request.sid)
 
 
-@socketio.on("page:change")
-def handle_page_change(data):
-    """ページ変更（講師のみ）"""
+def change_page(sid, data):
+    """ページ変更処理（連打時は保留された最新の1件がバックグラウンドから呼ばれる）"""
     room_id = data.get("room_id")
     page_number = data.get("page_number")
     
     room = room_manager.get_room(room_id)
     
     if not room:
-        emit("error", {"message": "Room not found"})
+        socketio.emit("error", {"message": "Room not found"}, room=sid)
         return
     
     # 講師チェック
-    participant = room.participants.get(request.sid)
+    participant = room.participants.get(sid)
     if not participant or participant.role != "instructor":
-        emit("error", {"message": "Permission denied"})
+        socketio.emit("error", {"message": "Permission denied"}, room=sid)
         return
     
     # ページ更新
     room.set_page(page_number)
     
-    # 全員に同期
-    emit("page:changed", {"page_number": page_number}, room=room_id)
+    # 全員に同期（プレースホルダー・後続ページの先読みヒント付き）
+    page = material_store.get_page(room.material_id, page_number) or {}
+    stamp = delivery_stamp(room)
+    broadcast(room, "page:changed", {
+        "page_number": page_number,
+        "placeholder": page.get("placeholder"),
+        "prefetch": material_store.get_prefetch_hints(room.material_id, page_number),
+        **stamp
+    })
+    lecture_recorder.record(room, "page:changed", {"page_number": page_number}, stamp["server_ts"])
     
-    print(f"Page changed to {page_number} in room {room_id}")
+    log_event("page:changed", room_id=room_id, page_number=page_number)
+
+
+@socketio.on("page:change")
+@rate_limited("page:change", coalesce=change_page)
+def handle_page_change(data):
+    """ページ変更（講師のみ）"""
+    change_page(request.sid, data)
 
 
 @socketio.on("sync:toggle")
+@rate_limited("sync:toggle")
 def handle_sync_toggle(data):
     """同期ON/OFF（講師のみ）"""
     room_id = data.get("room_id")
@@ -329,10 +724,12 @@ def handle_sync_toggle(data):
         return
     
     room.toggle_sync(enabled)
-    emit("sync:toggled", {"enabled": enabled}, room=room_id)
+    broadcast(room, "sync:toggled", {"enabled": enabled})
+    lecture_recorder.record(room, "sync:toggled", {"enabled": enabled})
 
 
 @socketio.on("annotation:add")
+@rate_limited("annotation:add")
 def handle_annotation_add(data):
     """注釈追加（講師のみ）"""
     room_id = data.get("room_id")
@@ -357,10 +754,112 @@ def handle_annotation_add(data):
     )
     
     room.add_annotation(annotation)
-    emit("annotation:added", annotation.to_dict(), room=room_id)
+    broadcast_annotation(room, annotation)
+
+
+@socketio.on("stroke:begin")
+@rate_limited("stroke:begin")
+def handle_stroke_begin(data):
+    """ペンストローク開始（講師のみ）"""
+    room_id = data.get("room_id")
+    stroke_id = data.get("stroke_id") or str(uuid.uuid4())
+    
+    room = room_manager.get_room(room_id)
+    
+    if not room:
+        return
+    
+    participant = room.participants.get(request.sid)
+    if not participant or participant.role != "instructor":
+        return
+    
+    session = StrokeSession(
+        id=stroke_id,
+        owner_sid=request.sid,
+        page_number=data.get("page_number", room.current_page),
+        data=data.get("data") or {}
+    )
+    
+    if not room.begin_stroke(session):
+        emit("error", {"message": "Stroke already in progress", "stroke_id": stroke_id})
+        return
+    
+    broadcast(room, "stroke:started", {
+        "stroke_id": stroke_id,
+        "page_number": session.page_number,
+        "data": session.data
+    }, skip_sid=request.sid, live=True)
+
+
+@socketio.on("stroke:append")
+@rate_limited("stroke:append")
+def handle_stroke_append(data):
+    """ペンストローク座標バッチ（講師のみ）- 受信次第リレーする"""
+    room_id = data.get("room_id")
+    stroke_id = data.get("stroke_id")
+    seq = data.get("seq", 0)
+    
+    # 順序判定で比較するため整数のみ受け付ける
+    if not isinstance(seq, int) or isinstance(seq, bool):
+        emit("error", {"message": "Invalid seq", "stroke_id": stroke_id})
+        return
+    
+    room = room_manager.get_room(room_id)
+    
+    if not room:
+        return
+    
+    participant = room.participants.get(request.sid)
+    if not participant or participant.role != "instructor":
+        return
+    
+    points = normalize_points(data.get("points"))
+    if not points:
+        return
+    
+    if stroke_id not in room.active_strokes:
+        emit("error", {"message": "Unknown stroke", "stroke_id": stroke_id})
+        return
+    
+    if not room.append_stroke(stroke_id, seq, points, owner_sid=request.sid):
+        return
+    
+    broadcast(room, "stroke:points", {
+        "stroke_id": stroke_id,
+        "seq": seq,
+        "packed": pack_points(points),
+        "scale": config.PEN_QUANT_SCALE
+    }, skip_sid=request.sid, live=True)
+
+
+@socketio.on("stroke:end")
+@rate_limited("stroke:end")
+def handle_stroke_end(data):
+    """ペンストローク終了（講師のみ）- 確定した注釈のみルームに保存"""
+    room_id = data.get("room_id")
+    stroke_id = data.get("stroke_id")
+    
+    room = room_manager.get_room(room_id)
+    
+    if not room:
+        return
+    
+    participant = room.participants.get(request.sid)
+    if not participant or participant.role != "instructor":
+        return
+    
+    annotation = room.end_stroke(stroke_id, owner_sid=request.sid)
+    
+    if annotation:
+        broadcast_annotation(room, annotation)
+    elif stroke_id in room.active_strokes:
+        emit("error", {"message": "Stroke owned by another instructor", "stroke_id": stroke_id})
+    else:
+        broadcast(room, "stroke:aborted", {"stroke_id": stroke_id})
 
 
 @socketio.on("annotation:remove")
+@rate_limited("annotation:remove")
 def handle_annotation_remove(data):
     """注釈削除（講師のみ）"""
     room_id = data.get("room_id")
@@ -376,10 +875,12 @@ def handle_annotation_remove(data):
         return
     
     room.remove_annotation(annotation_id)
-    emit("annotation:removed", {"id": annotation_id}, room=room_id)
+    broadcast(room, "annotation:removed", {"id": annotation_id})
+    lecture_recorder.record(room, "annotation:removed", {"id": annotation_id})
 
 
 @socketio.on("annotation:clear")
+@rate_limited("annotation:clear")
 def handle_annotation_clear(data):
     """注釈全削除（講師のみ）"""
     room_id = data.get("room_id")
@@ -394,10 +895,12 @@ def handle_annotation_clear(data):
         return
     
     room.clear_annotations()
-    emit("annotation:cleared", {}, room=room_id)
+    broadcast(room, "annotation:cleared", {})
+    lecture_recorder.record(room, "annotation:cleared", {})
 
 
 @socketio.on("important:display")
+@rate_limited("important:display")
 def handle_important_display(data):
     """重要ポイントカード表示（講師のみ）"""
     room_id = data.get("room_id")
@@ -413,10 +916,12 @@ def handle_important_display(data):
     if not participant or participant.role != "instructor":
         return
     
-    emit("important:show", {"title": title, "points": points}, room=room_id)
+    broadcast(room, "important:show", {"title": title, "points": points})
+    lecture_recorder.record(room, "important:show", {"title": title, "points": points})
 
 
 @socketio.on("important:hide")
+@rate_limited("important:hide")
 def handle_important_hide(data):
     """重要ポイントカード非表示（講師のみ）"""
     room_id = data.get("room_id")
@@ -430,22 +935,333 @@ def handle_important_hide(data):
     if not participant or participant.role != "instructor":
         return
     
-    emit("important:hide", {}, room=room_id)
+    broadcast(room, "important:hide", {})
+    lecture_recorder.record(room, "important:hide", {})
+
+
+@socketio.on("replay:start")
+@rate_limited("replay:start")
+def handle_replay_start(data):
+    """講義記録の再生開始（指定時刻の状態を送り、以降のイベントを再生速度で送る）"""
+    room_id = data.get("room_id")
+    
+    try:
+        speed = float(data.get("speed", 1))
+        t = int(data["t"]) if data.get("t") else None
+    except (TypeError, ValueError, OverflowError):
+        speed = t = None
+    if speed is None or not math.isfinite(speed):
+        emit("error", {"message": "Invalid replay parameters"})
+        return
+    speed = min(max(speed, 0.1), config.REPLAY_MAX_SPEED)
+    
+    recording = lecture_recorder.get_recording(room_id)
+    info = recording.info() if recording else None
+    
+    if not info:
+        emit("error", {"message": "Recording not found"})
+        return
+    
+    t = t or info["start"]
+    state, offset = recording.seek(t)
+    emit("replay:state", {"room_id": room_id, "t": t, "end": info["end"], "state": state})
+    
+    # 同じ接続の前の再生は止める
+    token = str(uuid.uuid4())
+    replay_sessions[request.sid] = token
+    socketio.start_background_task(stream_replay, request.sid, token, recording, offset, t, speed)
+
+
+@socketio.on("replay:stop")
+def handle_replay_stop(data=None):
+    """講義記録の再生停止"""
+    replay_sessions.pop(request.sid, None)
 
 
 # ========================================
 # Utility Functions
 # ========================================
 
-def load_manifest():
-    """manifest.json読み込み"""
-    manifest_path = config.MATERIALS_DIR / "manifest.json"
+class UploadError(Exception):
+    """アップロード受信エラー"""
+    
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+# アップロードの確認〜ジョブ投入の排他
+upload_lock = threading.Lock()
+
+
+def material_exists(material_id):
+    """
+    変換済みの教材があるか、同じ教材IDを変換中か
+    
+    変換に失敗した・途中で止まった教材は再アップロードで変換し直せる
+    """
+    if conversion_queue.is_active(material_id):
+        return True
+    metadata = material_store.get_metadata(material_id)
+    return bool(metadata) and metadata.get("status", "ready") == "ready"
+
+
+def save_upload_stream(stream, path: Path) -> int:
+    """
+    アップロードボディをチャンク単位でファイルに書き出す
+    
+    Returns:
+        書き込んだバイト数
+    
+    Raises:
+        UploadError: PDFでない・サイズ上限超過
+    """
+    received = 0
+    
+    with open(path, "wb") as f:
+        while True:
+            chunk = stream.read(config.UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            
+            if received == 0 and not chunk.startswith(b"%PDF-"):
+                raise UploadError("Not a PDF file")
+            
+            received += len(chunk)
+            if received > config.UPLOAD_MAX_BYTES:
+                raise UploadError("File too large", status=413)
+            
+            f.write(chunk)
+    
+    if received == 0:
+        raise UploadError("Empty body")
+    
+    return received
+
+
+def notify_conversion_progress(job):
+    """変換ジョブの進捗を管理画面へ送信"""
+    socketio.emit("conversion:progress", job.to_dict(), namespace="/admin")
+
+
+conversion_queue.on_update = notify_conversion_progress
+
+
+def reap_idle_rooms():
+    """無人のまま放置されたルームを定期的にメモリから追い出す"""
+    while True:
+        socketio.sleep(config.ROOM_REAP_INTERVAL)
+        
+        reaped = room_manager.reap_idle_rooms(config.ROOM_IDLE_TTL)
+        if reaped:
+            log_event("room:reaped", count=len(reaped), room_ids=reaped)
+        for room_id in reaped:
+            latency_tracker.forget(room_id)
+            lecture_recorder.forget(room_id)
+        
+        room_manager.purge_spilled_rooms(config.ROOM_SPILL_RETENTION)
+        
+        purged = lecture_recorder.purge_recordings(config.RECORDING_RETENTION)
+        if purged:
+            log_event("recording:purged", count=purged)
+
+
+def flush_presence():
+    """
+    溜まった入退室差分を一定間隔でまとめて送信
     
-    if not manifest_path.exists():
-        return {"version": "1.0", "materials": []}
+    講師には参加者の差分を、ルーム全体には人数のみを送る
+    """
+    while True:
+        socketio.sleep(config.PRESENCE_BATCH_INTERVAL)
+        
+        for delta in presence_batcher.drain():
+            room = room_manager.rooms.get(delta.room_id)
+            if not room:
+                continue
+            
+            count = len(room.participants)
+            broadcast(room, "presence:count", {"count": count})
+            
+            payload = delta.to_dict()
+            payload["count"] = count
+            for sid in room.instructor_sids():
+                socketio.emit("presence:delta", payload, room=sid)
+
+
+def broadcast(room, event, payload, skip_sid=None, live=False):
+    """
+    ルーム全員への配信（シャードごとに分けて配信ワーカーに積む）
     
-    with open(manifest_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    1回の送信で回す接続数はシャードの定員まで。live=Trueなら
+    送信が滞った接続を外した配信用サブルームにだけ送る
+    """
+    shards = room.shard_names()
+    if live:
+        shards = [live_room(shard) for shard in shards]
+    shard_fanout.publish(shards, event, payload, skip_sid=skip_sid)
+
+
+def emit_to_shard(event, payload, shard, skip_sid):
+    """配信ワーカーからの送信"""
+    socketio.emit(event, payload, room=shard, skip_sid=skip_sid, namespace="/")
+
+
+shard_fanout.emit = emit_to_shard
+
+
+def delivery_stamp(room):
+    """遅延計測用のサーバー時刻と連番（page:changed・annotation:addedに付ける）"""
+    return {"server_ts": server_timestamp(), "seq": room.next_seq()}
+
+
+def broadcast_annotation(room, annotation):
+    """確定した注釈をルーム全員に送り、講義記録に残す"""
+    stamp = delivery_stamp(room)
+    broadcast(room, "annotation:added", {**annotation.to_dict(), **stamp})
+    lecture_recorder.record(room, "annotation:added", annotation.to_dict(binary=False), stamp["server_ts"])
+
+
+# 再生中の接続 (sid -> 再生トークン)
+replay_sessions = {}
+
+
+def stream_replay(sid, token, recording, offset, t, speed):
+    """記録のイベントを元の間隔÷速度で送る（停止・別の再生開始で打ち切る）"""
+    clock = t
+    for record in recording.iter_events(offset):
+        socketio.sleep(max(0, record["t"] - clock) / 1000 / speed)
+        if replay_sessions.get(sid) != token:
+            return
+        
+        clock = record["t"]
+        socketio.emit("replay:event", record, room=sid)
+    
+    if replay_sessions.get(sid) == token:
+        del replay_sessions[sid]
+        socketio.emit("replay:ended", {"t": clock}, room=sid)
+
+
+def live_room(shard):
+    """描画中ストローク配信用のサブルーム名（送信が滞った接続はここから外す）"""
+    return f"{shard}:live"
+
+
+def flush_deferred_event(sid, event, handler):
+    """レート制限で保留したイベントをトークンが貯まってから処理"""
+    socketio.sleep(rate_limiter.retry_after(sid, event))
+    
+    data = rate_limiter.pop_deferred(sid, event)
+    if data is not None:
+        rate_limiter.allow(sid, event)
+        handler(sid, data)
+
+
+# 送信キューが溢れかけてライブ配信を止めている接続
+downgraded_sids = set()
+
+
+def outbound_queue_size(sid):
+    """接続の未送信メッセージ数（取得できなければ0）"""
+    try:
+        eio_sid = socketio.server.manager.eio_sid_from_sid(sid, "/")
+        eio_socket = socketio.server.eio.sockets.get(eio_sid)
+        return eio_socket.queue.qsize() if eio_socket else 0
+    except Exception:
+        return 0
+
+
+def monitor_outbound_queues():
+    """
+    送信が追いつかない接続を検出して配信を絞る
+    
+    未送信が溜まった接続は描画中ストロークの配信を止め（確定した注釈は届く）、
+    さらに溜まれば切断する。ブロードキャストが遅い接続に引きずられないようにする。
+    """
+    while True:
+        socketio.sleep(config.OUTBOUND_QUEUE_CHECK_INTERVAL)
+        
+        for room in list(room_manager.rooms.values()):
+            for sid in list(room.participants):
+                size = outbound_queue_size(sid)
+                
+                if size > config.OUTBOUND_QUEUE_DISCONNECT:
+                    log_event("backpressure:disconnected", logging.WARNING, sid=sid, queued=size)
+                    socketio.server.disconnect(sid, namespace="/")
+                elif size > config.OUTBOUND_QUEUE_DOWNGRADE and sid not in downgraded_sids:
+                    socketio.server.leave_room(sid, live_room(room.shard_of(sid)), namespace="/")
+                    downgraded_sids.add(sid)
+                    log_event("backpressure:downgraded", logging.WARNING, sid=sid, queued=size)
+                    socketio.emit("sync:downgraded", {"live": False}, room=sid)
+                elif size < config.OUTBOUND_QUEUE_RECOVER and sid in downgraded_sids:
+                    socketio.server.enter_room(sid, live_room(room.shard_of(sid)), namespace="/")
+                    downgraded_sids.discard(sid)
+                    socketio.emit("sync:downgraded", {"live": True}, room=sid)
+
+
+def push_admin_updates():
+    """
+    管理画面へ集計を一定間隔で配信
+    
+    集計は管理画面の数によらず1回だけ行い、名前空間全体にまとめて送る。
+    ルーム状況は前回から変わったときだけ、フィードバックは新着があったときだけ送る。
+    """
+    while True:
+        socketio.sleep(config.ADMIN_PUSH_INTERVAL)
+        
+        rooms = admin_metrics.summarize_rooms(list(room_manager.rooms.values()))
+        feedbacks = admin_metrics.drain_feedbacks()
+        changed = rooms != admin_metrics.last_rooms
+        admin_metrics.last_rooms = rooms
+        
+        if not admin_metrics.admin_count:
+            continue
+        
+        if changed:
+            socketio.emit("admin:rooms", {"rooms": rooms}, namespace="/admin")
+        
+        if feedbacks:
+            stats = feedback_manager.get_statistics()
+            stats["latency_correlation"] = latency_tracker.correlate_with_feedback(
+                feedback_manager.get_all_feedbacks()
+            )
+            socketio.emit("admin:feedback", {"added": feedbacks, "statistics": stats}, namespace="/admin")
+
+
+def start_background_tasks():
+    """バックグラウンドタスク起動"""
+    changes = check_manifest(config.MATERIALS_DIR)
+    if any(changes.values()):
+        log_event("manifest:updated", **changes)
+    
+    socketio.start_background_task(reap_idle_rooms)
+    socketio.start_background_task(flush_presence)
+    socketio.start_background_task(monitor_outbound_queues)
+    socketio.start_background_task(push_admin_updates)
+    socketio.start_background_task(conversion_queue.forward_progress)
+    for index in range(len(shard_fanout.queues)):
+        socketio.start_background_task(shard_fanout.run_worker, index)
+
+
+def expire_orphan_strokes(room_id):
+    """切断した講師のストロークを猶予時間後に確定・破棄する"""
+    socketio.sleep(config.STROKE_SESSION_TIMEOUT)
+    
+    room = room_manager.get_room(room_id)
+    if not room:
+        return
+    
+    committed, aborted = room.expire_strokes(config.STROKE_SESSION_TIMEOUT)
+    
+    for annotation in committed:
+        broadcast_annotation(room, annotation)
+    for stroke_id in aborted:
+        broadcast(room, "stroke:aborted", {"stroke_id": stroke_id})
+
+
+def load_manifest():
+    """manifest.json読み込み"""
+    return load_manifest_file(config.MATERIALS_DIR)
 
 
 # ========================================
@@ -458,6 +1274,8 @@ if __name__ == "__main__":
     print(f"URL: http://localhost:5000")
     print()
     
+    start_background_tasks()
+    
     socketio.run(
         app,
         host="0.0.0.0",
@@ -11,16 +11,104 @@ BASE_DIR = Path(__file__).parent.absolute()
 STATIC_DIR = BASE_DIR / "static"
 MATERIALS_DIR = STATIC_DIR / "materials"
 UPLOADS_DIR = BASE_DIR / "uploads"
+SEARCH_INDEX_PATH = BASE_DIR / "data" / "search_index.json"
+ASSET_STORE_DIR = BASE_DIR / "assets"  # 内容ハッシュで保存するページ画像
 
 # 教材設定
 MATERIAL_PAGE_MAX_WIDTH = 1400  # ページ画像の最大幅
 MATERIAL_THUMB_WIDTH = 320      # サムネイル幅
 MATERIAL_PAGE_FORMAT = "jpg"    # ページ画像フォーマット
 MATERIAL_QUALITY = 90           # JPEG品質
+THUMB_ATLAS_COLUMNS = 8         # サムネイルスプライトの列数
+PLACEHOLDER_WIDTH = 32          # 低画質プレースホルダーの幅
+PLACEHOLDER_QUALITY = 40        # 低画質プレースホルダーのJPEG品質
+SEARCH_RESULT_LIMIT = 20        # 全文検索の最大件数
+ASSET_STORE_ENABLED = True      # ページ画像をアセットストアに重複なく保存するか
+ASSET_CACHE_MAX_AGE = 365 * 24 * 3600  # アセットのブラウザキャッシュ期間 (秒)
+DECK_BUNDLE_ON_CONVERT = False  # 変換時に一括ダウンロード用バンドルも生成するか (ページ画像を2重に持つため既定は要求時のみ)
+PREFETCH_PAGE_COUNT = 2         # ページ変更時に先読みさせる後続ページ数
+
+# アップロード・変換設定
+UPLOAD_MAX_BYTES = 200 * 1024 * 1024  # アップロード最大サイズ
+UPLOAD_CHUNK_SIZE = 1024 * 1024       # ディスク書き込み単位
+CONVERSION_WORKERS = 1          # 同時変換数 (講義中の応答性を優先して小さく)
+CONVERSION_MAX_PENDING = 10     # 変換待ちジョブの上限
+CONVERSION_NICE = 10            # 変換プロセスのnice値
+METADATA_PUBLISH_INTERVAL = 1.0 # 変換中にmetadata.jsonを書き出す間隔 (秒)
+
+# ペン注釈設定
+PEN_QUANT_SCALE = 100           # 座標量子化倍率 (0.01%単位、uint16に収まる)
+PEN_SIMPLIFY_TOLERANCE = 0.1    # 間引き許容誤差 (パーセント座標、0で無効)
+STROKE_MAX_POINTS = 10000       # 1ストロークあたりの最大点数
+STROKE_SESSION_TIMEOUT = 10     # 講師切断後、描画中ストロークを確定するまでの秒数
+
+# ルーム管理設定
+ROOM_IDLE_TTL = int(os.environ.get("ROOM_IDLE_TTL", 3600))  # 無人ルームをメモリから追い出すまでの秒数
+ROOM_REAP_INTERVAL = 60         # アイドルルーム確認間隔 (秒)
+ROOM_SPILL_ENABLED = True       # 追い出したルームをディスクに退避するか
+ROOM_SPILL_DIR = BASE_DIR / "data" / "rooms"
+ROOM_SPILL_RETENTION = 30 * 24 * 3600  # 退避ファイルの保持期間 (秒)
+PRESENCE_BATCH_INTERVAL = 1.0   # 入退室通知をまとめて送る間隔 (秒)
+
+# 講義記録設定
+RECORDING_ENABLED = True        # ルームイベントを記録するか
+RECORDING_DIR = BASE_DIR / "data" / "recordings"
+RECORDING_RETENTION = 30 * 24 * 3600  # 最終記録からの保持期間 (秒)
+RECORDING_KEYFRAME_INTERVAL = 30   # キーフレームを書く間隔 (秒)
+RECORDING_KEYFRAME_EVENTS = 200    # この件数ごとにもキーフレームを書く (シーク時に適用する上限)
+REPLAY_MAX_SPEED = 16              # 再生速度の上限 (倍)
 
 # WebSocket設定
 SOCKETIO_CORS_ALLOWED_ORIGINS = "*"  # 本番では制限すること
 
+# 大人数講義の分割配信設定
+ROOM_SHARD_SIZE = 200   # 1シャードの定員 (1回の送信で回す接続数の上限)
+FANOUT_WORKERS = 4      # シャード配信ワーカー数
+
+# レート制限設定 (イベント名: (毎秒の補充数, バースト上限))
+RATE_LIMITS = {
+    "room:join": (0.5, 5),
+    "page:change": (4, 8),          # 超過分は最新の1件にまとめて後から反映
+    "annotation:add": (10, 30),
+    "stroke:begin": (10, 20),
+    "stroke:append": (60, 120),
+    "stroke:end": (10, 20),
+}
+RATE_LIMIT_DEFAULT = (10, 20)       # 上記以外のイベント
+
+# 遅延テレメトリ設定
+LATENCY_SAMPLE_RATE = 0.2           # クライアントが計測するイベントの割合
+LATENCY_BATCH_SIZE = 20             # この件数たまったら報告する
+LATENCY_FLUSH_INTERVAL = 10         # 件数に満たなくても報告する間隔 (秒)
+LATENCY_MAX_BATCH = 50              # 1回の報告で受け付ける最大件数
+LATENCY_MAX_MS = 60000              # これを超える値は外れ値として捨てる
+LATENCY_BUCKETS_MS = (25, 50, 100, 200, 400, 800, 1600, 3200, 6400)  # ヒストグラムのバケット上限
+
+# 管理画面設定
+ADMIN_PUSH_INTERVAL = 2.0           # ルーム状況・フィードバックを管理画面へ送る間隔 (秒)
+
+# 送信キュー監視設定 (接続ごとの未送信メッセージ数)
+OUTBOUND_QUEUE_CHECK_INTERVAL = 1.0  # 確認間隔 (秒)
+OUTBOUND_QUEUE_DOWNGRADE = 200       # 超えたら描画中ストロークの配信を止める
+OUTBOUND_QUEUE_RECOVER = 20          # 下回ったら配信を再開する
+OUTBOUND_QUEUE_DISCONNECT = 2000     # 超えたら切断する
+
+# ログ設定
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_FILE = os.environ.get("LOG_FILE")  # 未設定なら標準出力のみ
+LOG_QUEUE_SIZE = 10000               # 書き出し待ちの上限 (超えた分は捨てる)
+LOG_SAMPLE_RATES = {                 # 頻度の高いイベントは一部だけ記録する
+    "client:connected": 0.1,
+    "client:disconnected": 0.1,
+    "room:joined": 0.2,
+    "rate:limited": 0.01,
+}
+
+# 診断設定
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")  # 未設定なら診断APIは無効
+PROFILER_SAMPLE_INTERVAL = 0.02      # スタック採取間隔 (秒、短くするほど採取自体の負荷が増える)
+PROFILER_MAX_SECONDS = 120           # 1回のプロファイルの最長時間 (秒)
+
 # Flask設定
 SECRET_KEY = os.environ.get("SECRET_KEY", "dev-secret-key-change-in-production")
 DEBUG = os.environ.get("DEBUG", "True").lower() == "true"
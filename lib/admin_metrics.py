@@ -0,0 +1,83 @@
+"""
+管理画面集計モジュール - ダッシュボードへ定期配信するルーム・フィードバックの要約
+"""
+from typing import Dict, List, Optional
+import threading
+import time
+
+
+class AdminMetrics:
+    """
+    管理画面向けの集計
+
+    ハンドラはイベント数・新着フィードバックを積むだけにし、
+    配信ループが一定間隔で1回だけ要約を作って全管理画面へ送る。
+    管理画面の数が増えても集計の負荷は変わらない。
+    """
+
+    def __init__(self):
+        self.event_counts: Dict[str, int] = {}
+        self.new_feedbacks: List[dict] = []
+        self.admin_count = 0
+        self.last_rooms: Optional[List[dict]] = None
+        self._window_started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def count_event(self, room_id: Optional[str]):
+        """受信イベントを数える (イベントレート算出用)"""
+        if not room_id:
+            return
+        with self._lock:
+            self.event_counts[room_id] = self.event_counts.get(room_id, 0) + 1
+
+    def add_feedback(self, feedback: dict):
+        """新着フィードバックを積む"""
+        with self._lock:
+            self.new_feedbacks.append(feedback)
+
+    def admin_connected(self):
+        with self._lock:
+            self.admin_count += 1
+
+    def admin_disconnected(self):
+        with self._lock:
+            self.admin_count = max(0, self.admin_count - 1)
+
+    def summarize_rooms(self, rooms) -> List[dict]:
+        """
+        ルームの要約 (前回呼び出しからのイベントレート付き)
+
+        参加者・注釈の中身は含めず件数のみ返す
+        """
+        with self._lock:
+            now = time.monotonic()
+            elapsed = max(now - self._window_started, 1e-6)
+            counts, self.event_counts = self.event_counts, {}
+            self._window_started = now
+
+        summary = []
+        for room in rooms:
+            participants = list(room.participants.values())
+            instructors = sum(1 for p in participants if p.role == "instructor")
+            summary.append({
+                "room_id": room.room_id,
+                "material_id": room.material_id,
+                "current_page": room.current_page,
+                "sync_enabled": room.sync_enabled,
+                "instructors": instructors,
+                "students": len(participants) - instructors,
+                "annotations": len(room.annotations),
+                "shards": len(room.shard_names()),
+                "events_per_sec": round(counts.get(room.room_id, 0) / elapsed, 2)
+            })
+        return sorted(summary, key=lambda r: r["room_id"])
+
+    def drain_feedbacks(self) -> List[dict]:
+        """前回以降の新着フィードバックを取り出す"""
+        with self._lock:
+            feedbacks, self.new_feedbacks = self.new_feedbacks, []
+        return feedbacks
+
+
+# グローバルインスタンス
+admin_metrics = AdminMetrics()
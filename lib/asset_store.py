@@ -0,0 +1,92 @@
+"""
+コンテンツアドレス型アセットストア - 内容のハッシュをキーに画像を1度だけ保存
+"""
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+import hashlib
+import os
+import tempfile
+import config
+
+
+class AssetStore:
+    """
+    SHA-256をキーにしたアセット保存先
+
+    同じ内容のファイル (教材間・改訂版間で共通のページ等) は1つだけ保存される。
+    URLに内容のハッシュが入るため、クライアントは無期限にキャッシュしてよい。
+    """
+
+    def __init__(self, root_dir: Path, url_prefix: str = "/assets"):
+        self.root_dir = Path(root_dir)
+        self.url_prefix = url_prefix.rstrip("/")
+
+    def put(self, data: bytes, ext: str) -> Tuple[str, str]:
+        """
+        アセット保存 (既に同じ内容があれば書き込まない)
+
+        Returns:
+            (ハッシュ, URL)
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest, ext)
+
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+        return digest, self.url_for(digest, ext)
+
+    def put_file(self, source: Path) -> Tuple[str, str]:
+        """既存ファイルを取り込む"""
+        source = Path(source)
+        return self.put(source.read_bytes(), source.suffix.lstrip("."))
+
+    def url_for(self, digest: str, ext: str) -> str:
+        """アセットURL"""
+        return f"{self.url_prefix}/{digest[:2]}/{digest}.{ext}"
+
+    def path_for_url(self, url: str) -> Optional[Path]:
+        """アセットURLをファイルパスに変換 (このストアのURLでなければNone)"""
+        if not url.startswith(self.url_prefix + "/"):
+            return None
+        relative = url[len(self.url_prefix) + 1:].split("?", 1)[0]
+        path = (self.root_dir / relative).resolve()
+        if self.root_dir.resolve() not in path.parents:
+            return None
+        return path
+
+    def prune(self, referenced: Iterable[str]) -> int:
+        """
+        どの教材からも参照されていないアセットを削除
+
+        Args:
+            referenced: 参照中のハッシュ
+        Returns:
+            削除したファイル数
+        """
+        referenced = set(referenced)
+        removed = 0
+        for path in self.root_dir.glob("*/*.*"):
+            if path.suffix == ".tmp":
+                continue
+            if path.stem not in referenced:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+    def _path(self, digest: str, ext: str) -> Path:
+        """保存パス (先頭2文字でディレクトリを分ける)"""
+        return self.root_dir / digest[:2] / f"{digest}.{ext}"
+
+
+# グローバルインスタンス
+asset_store = AssetStore(config.ASSET_STORE_DIR)
+
+
+def url_to_path(url: str) -> Path:
+    """画像URL (アセットストアまたは/static/以下) をファイルパスに変換"""
+    return asset_store.path_for_url(url) or config.STATIC_DIR / url.split("?", 1)[0].removeprefix("/static/")
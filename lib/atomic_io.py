@@ -0,0 +1,30 @@
+"""
+ファイル書き込みユーティリティ - 読み手が途中状態を見ないアトミック書き込み
+"""
+import json
+import os
+import tempfile
+from pathlib import Path
+
+
+def write_json_atomic(path: Path, data, indent: int = 2):
+    """
+    JSONを一時ファイルに書き出してから置き換える
+
+    同じディレクトリに一時ファイルを作りos.replaceするため、
+    読み手は常に書き込み前か後の完全なファイルを読む。
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,186 @@
+"""
+変換ジョブ管理モジュール - アップロードPDFの別プロセスでの変換
+"""
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+import config
+from lib.event_log import log_event
+
+
+@dataclass
+class ConversionJob:
+    """変換ジョブ"""
+    id: str
+    filename: str
+    material_id: str
+    status: str  # "queued", "converting", "done", "error"
+    created_at: str
+    pages_done: int = 0
+    total_pages: int = 0
+    error: Optional[str] = None
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class ConversionQueue:
+    """
+    変換ジョブキュー
+
+    変換は別プロセスのワーカーで行う (PyMuPDFの描画中はGILが解放されず、
+    同一プロセスのスレッドで変換するとSocket.IOのハンドラが止まるため)。
+    進捗はプロセス間キューで受け取り、forward_progressが通知に変換する。
+    実行中+待機中がmax_workers+max_pendingを超える投入は拒否する。
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, history_size: int = 100):
+        self.max_workers = max_workers
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self.history_size = history_size
+        self.jobs: "OrderedDict[str, ConversionJob]" = OrderedDict()
+        self.on_update: Optional[Callable[[ConversionJob], None]] = None
+        # ワーカープロセスは最初の投入時に起動する (ワーカー側でこのモジュールを読んだときに作らないため)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._progress = None
+
+    def submit(self, pdf_path: Path, material_id: str) -> Optional[ConversionJob]:
+        """ジョブ投入 (キューが満杯・同じ教材IDを変換中ならNone)"""
+        if not self._slots.acquire(blocking=False):
+            return None
+
+        job = ConversionJob(
+            id=str(uuid.uuid4()),
+            filename=Path(pdf_path).name,
+            material_id=material_id,
+            status="queued",
+            created_at=datetime.now().isoformat()
+        )
+
+        with self._lock:
+            if self._is_active(material_id):
+                self._slots.release()
+                return None
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.history_size:
+                self.jobs.popitem(last=False)
+
+        self._notify(job)
+        try:
+            future = self._get_executor().submit(_convert_in_worker, job.id, str(pdf_path), material_id)
+        except BrokenProcessPool:
+            # ワーカーが異常終了したプールは作り直す
+            with self._lock:
+                self._executor = None
+            future = self._get_executor().submit(_convert_in_worker, job.id, str(pdf_path), material_id)
+        future.add_done_callback(lambda f: self._finish(job, f))
+        return job
+
+    def is_active(self, material_id: str) -> bool:
+        """同じ教材IDのジョブが待機中・変換中か"""
+        with self._lock:
+            return self._is_active(material_id)
+
+    def _is_active(self, material_id: str) -> bool:
+        return any(job.material_id == material_id and job.status in ("queued", "converting")
+                   for job in self.jobs.values())
+
+    def get_job(self, job_id: str) -> Optional[ConversionJob]:
+        """ジョブ取得"""
+        return self.jobs.get(job_id)
+
+    def get_all_jobs(self) -> List[dict]:
+        """全ジョブ取得 (新しい順)"""
+        with self._lock:
+            return [job.to_dict() for job in reversed(self.jobs.values())]
+
+    def forward_progress(self):
+        """ワーカープロセスからの進捗を通知する (バックグラウンドタスクとして起動する)"""
+        self._get_executor()
+        while True:
+            job_id, pages_done, total_pages = self._progress.get()
+            job = self.jobs.get(job_id)
+            # 完了通知の後に届いた古い進捗は捨てる
+            if not job or job.status not in ("queued", "converting"):
+                continue
+            job.status = "converting"
+            job.pages_done = pages_done
+            job.total_pages = total_pages
+            self._notify(job)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """ワーカープロセスのプール (spawnで起動し、サーバーのスレッド・ソケットを引き継がない)"""
+        with self._lock:
+            context = multiprocessing.get_context("spawn")
+            if self._progress is None:
+                self._progress = context.Queue()
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(self._progress,)
+                )
+            return self._executor
+
+    def _finish(self, job: ConversionJob, future: Future):
+        """変換完了・失敗の反映 (プールの管理スレッドから呼ばれる)"""
+        try:
+            error = future.exception()
+            if error:
+                job.status = "error"
+                job.error = str(error)
+                log_event("conversion:failed", logging.ERROR, job_id=job.id, material_id=job.material_id, error=str(error))
+            else:
+                job.status = "done"
+        finally:
+            self._slots.release()
+            self._notify(job)
+
+    def _notify(self, job: ConversionJob):
+        """進捗通知"""
+        if self.on_update:
+            try:
+                self.on_update(job)
+            except Exception as e:
+                log_event("conversion:notify_failed", logging.WARNING, job_id=job.id, error=str(e))
+
+
+# ワーカープロセス側の進捗キュー
+_worker_progress = None
+
+
+def _init_worker(progress_queue):
+    """ワーカープロセスの初期化 (優先度を下げ、進捗キューを受け取る)"""
+    global _worker_progress
+    _worker_progress = progress_queue
+    try:
+        os.nice(config.CONVERSION_NICE)
+    except (AttributeError, OSError):
+        pass
+
+
+def _convert_in_worker(job_id: str, pdf_path: str, material_id: str):
+    """ワーカープロセスでの変換処理 (manifest.json・検索インデックスも変換処理側で更新される)"""
+    from lib.pdf_processor import PDFProcessor
+
+    _worker_progress.put((job_id, 0, 0))
+
+    def on_progress(pages_done: int, total_pages: int):
+        _worker_progress.put((job_id, pages_done, total_pages))
+
+    PDFProcessor(pdf_path, material_id).convert(progress_callback=on_progress)
+
+
+# グローバルインスタンス
+conversion_queue = ConversionQueue(config.CONVERSION_WORKERS, config.CONVERSION_MAX_PENDING)
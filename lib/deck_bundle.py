@@ -0,0 +1,173 @@
+"""
+教材バンドルモジュール - 全ページ画像をまとめたアーカイブと事前キャッシュ用マニフェスト
+"""
+from pathlib import Path
+from typing import Dict, List, Optional
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zipfile
+from lib.asset_store import url_to_path
+from lib.atomic_io import write_json_atomic
+
+
+BUNDLE_NAME = "bundle.zip"
+PRECACHE_NAME = "precache.json"
+
+_build_locks: Dict[str, threading.Lock] = {}
+_build_locks_guard = threading.Lock()
+
+
+def _file_sha256(path: Path) -> str:
+    """ファイルのSHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def list_assets(metadata: Dict) -> List[dict]:
+    """
+    バンドル対象のアセット一覧 (ページ画像・サムネイル・サムネイルスプライト)
+
+    アセットストア保存分はメタデータのハッシュをそのまま使い、それ以外はファイルから計算する。
+    内容が同じページ (白紙など) はURLを共有するため、URLごとに最初の1件だけ残す
+
+    Returns:
+        [{"url", "sha256", "size", "page_number", "kind"}, ...]
+    """
+    entries = []
+    for page in metadata.get("pages", []):
+        entries.append((page.get("image_url"), page.get("image_hash"), page["page_number"], "page"))
+        entries.append((page.get("thumbnail_url"), page.get("thumbnail_hash"), page["page_number"], "thumbnail"))
+
+    atlas = metadata.get("thumbnail_atlas") or {}
+    if atlas.get("url"):
+        entries.append((atlas["url"], atlas.get("hash"), None, "atlas"))
+
+    assets = []
+    seen = set()
+    for url, digest, page_number, kind in entries:
+        if not url or url in seen:
+            continue
+        seen.add(url)
+        path = url_to_path(url)
+        assets.append({
+            "url": url,
+            "sha256": digest or _file_sha256(path),
+            "size": path.stat().st_size,
+            "page_number": page_number,
+            "kind": kind
+        })
+    return assets
+
+
+def build_precache(material_dir: Path, metadata: Dict) -> dict:
+    """
+    事前キャッシュ用マニフェスト (precache.json) を生成
+
+    アセットのURL・ハッシュ・サイズとバンドルのURLのみで、バンドル自体は作らない
+    (クライアントはアセットを個別に取得してキャッシュできる)
+
+    Returns:
+        事前キャッシュ用マニフェスト
+    """
+    material_dir = Path(material_dir)
+    assets = list_assets(metadata)
+    revision = hashlib.sha256("".join(a["sha256"] for a in assets).encode()).hexdigest()[:16]
+
+    precache = {
+        "material_id": metadata["id"],
+        "revision": revision,
+        "bundle": {"url": f"/api/materials/{metadata['id']}/bundle"},
+        "total_size": sum(a["size"] for a in assets),
+        "assets": assets
+    }
+    write_json_atomic(material_dir / PRECACHE_NAME, precache)
+    return precache
+
+
+def build_bundle(material_dir: Path, metadata: Dict) -> Path:
+    """
+    教材バンドル (bundle.zip) を生成
+
+    全アセットを無圧縮で格納 (JPEG/PNGは再圧縮しても縮まないため)。
+    アーカイブ内のパスはURLから先頭の/を除いたもの。
+    ページ画像と同じ内容をもう1部持つことになるため、要求されたときだけ作る
+
+    Returns:
+        バンドルのパス
+    """
+    material_dir = Path(material_dir)
+
+    fd, tmp_path = tempfile.mkstemp(dir=material_dir, suffix=".tmp")
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED) as archive:
+            for asset in list_assets(metadata):
+                archive.write(url_to_path(asset["url"]), asset["url"].lstrip("/"))
+        os.replace(tmp_path, material_dir / BUNDLE_NAME)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+    return material_dir / BUNDLE_NAME
+
+
+def get_precache(material_dir: Path, metadata: Dict) -> Optional[dict]:
+    """
+    事前キャッシュ用マニフェスト取得 (無いか古ければその場で生成)
+
+    変換中の教材はNone
+    """
+    if metadata.get("status", "ready") != "ready":
+        return None
+
+    material_dir = Path(material_dir)
+    with _material_lock(material_dir):
+        precache = load_precache(material_dir)
+        if precache and _is_fresh(material_dir / PRECACHE_NAME, material_dir):
+            return precache
+        return build_precache(material_dir, metadata)
+
+
+def get_bundle(material_dir: Path, metadata: Dict) -> Optional[Path]:
+    """
+    教材バンドルのパス取得 (無いか古ければその場で生成)
+
+    変換中の教材はNone
+    """
+    if metadata.get("status", "ready") != "ready":
+        return None
+
+    material_dir = Path(material_dir)
+    with _material_lock(material_dir):
+        bundle_path = material_dir / BUNDLE_NAME
+        if _is_fresh(bundle_path, material_dir):
+            return bundle_path
+        return build_bundle(material_dir, metadata)
+
+
+def load_precache(material_dir: Path) -> Optional[dict]:
+    """precache.json読み込み (無ければNone)"""
+    try:
+        with open(Path(material_dir) / PRECACHE_NAME, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _is_fresh(path: Path, material_dir: Path) -> bool:
+    """生成物がmetadata.jsonより新しいか"""
+    try:
+        return path.stat().st_mtime_ns >= (material_dir / "metadata.json").stat().st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def _material_lock(material_dir: Path) -> threading.Lock:
+    """教材ごとの生成ロック"""
+    with _build_locks_guard:
+        return _build_locks.setdefault(material_dir.name, threading.Lock())
@@ -0,0 +1,115 @@
+"""
+構造化ログモジュール - JSONイベントログをキュー経由で別スレッドから書き出す
+"""
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import config
+
+
+logger = logging.getLogger("marutami")
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional["DroppingQueueHandler"] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """1行1JSONのフォーマッタ ({"ts", "level", "event", ...フィールド})"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "event": record.getMessage()
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    キューに積むだけのハンドラ (キューが満杯なら捨てる)
+
+    整形・書き込みはQueueListenerのスレッドで行うため、
+    呼び出し元はログの出力先の速度に影響されない
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 同一プロセス内のキューなので整形せずにそのまま渡す
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging():
+    """ログ出力の初期化 (2回目以降は何もしない)"""
+    global _listener, _queue_handler
+    if _listener:
+        return
+
+    formatter = JsonFormatter()
+    sinks = [logging.StreamHandler(sys.stdout)]
+    if config.LOG_FILE:
+        sinks.append(logging.FileHandler(config.LOG_FILE, encoding="utf-8"))
+    for sink in sinks:
+        sink.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+    _queue_handler = DroppingQueueHandler(log_queue)
+    logger.addHandler(_queue_handler)
+    logger.setLevel(config.LOG_LEVEL)
+    logger.propagate = False
+
+    _listener = QueueListener(log_queue, *sinks, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_shutdown_logging)
+
+
+def _shutdown_logging():
+    """残りのログを書き出してからリスナーを止め、捨てた件数を出力先へ直接書く"""
+    _listener.stop()
+    if _queue_handler.dropped:
+        record = logger.makeRecord(logger.name, logging.WARNING, __file__, 0, "log:dropped", None, None,
+                                   extra={"fields": {"count": _queue_handler.dropped}})
+        for sink in _listener.handlers:
+            sink.handle(record)
+
+
+def log_event(event: str, level: int = logging.INFO, **fields):
+    """
+    イベントを記録
+
+    config.LOG_SAMPLE_RATESに設定したイベントは指定割合だけ記録し、
+    集計時に補正できるようsample_rateを付ける
+
+    Args:
+        event: イベント名 (例: "room:joined")
+        level: ログレベル
+        **fields: JSONに含めるフィールド
+    """
+    if not logger.isEnabledFor(level):
+        return
+
+    rate = config.LOG_SAMPLE_RATES.get(event, 1.0)
+    if rate < 1.0:
+        if random.random() >= rate:
+            return
+        fields["sample_rate"] = rate
+
+    logger.log(level, event, extra={"fields": fields})
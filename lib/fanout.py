@@ -0,0 +1,49 @@
+"""
+分割配信モジュール - ルームのシャードごとに配信を固定ワーカーへ振り分ける
+"""
+from typing import Callable, Iterable, List, Optional
+import logging
+import queue
+import zlib
+import config
+from lib.event_log import log_event
+
+
+class ShardFanout:
+    """
+    シャード単位の配信キュー
+
+    シャードはハッシュで常に同じワーカーに割り当てるため、同じシャード内の配信順は保たれる。
+    1回の送信が回す接続数はシャードの定員までに収まり、ハンドラは積むだけで戻る。
+    """
+
+    def __init__(self, workers: int):
+        self.queues: List[queue.Queue] = [queue.Queue() for _ in range(workers)]
+        # (event, payload, room, skip_sid) を受け取る送信関数 (アプリ側で設定)
+        self.emit: Optional[Callable] = None
+
+    def publish(self, shards: Iterable[str], event: str, payload, skip_sid: str = None):
+        """各シャードへの配信を積む"""
+        for shard in shards:
+            self._queue_for(shard).put((shard, event, payload, skip_sid))
+
+    def run_worker(self, index: int):
+        """ワーカーループ (バックグラウンドタスクとして起動する)"""
+        work = self.queues[index]
+        while True:
+            shard, event, payload, skip_sid = work.get()
+            try:
+                self.emit(event, payload, shard, skip_sid)
+            except Exception as e:
+                log_event("fanout:emit_failed", logging.ERROR, shard=shard, socket_event=event, error=str(e))
+
+    def backlog(self) -> List[int]:
+        """ワーカーごとの未処理件数"""
+        return [q.qsize() for q in self.queues]
+
+    def _queue_for(self, shard: str) -> queue.Queue:
+        return self.queues[zlib.crc32(shard.encode("utf-8")) % len(self.queues)]
+
+
+# グローバルインスタンス
+shard_fanout = ShardFanout(config.FANOUT_WORKERS)
@@ -0,0 +1,163 @@
+"""
+同期遅延テレメトリモジュール - クライアントからの受信・描画時刻をルームごとに集計
+"""
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+import threading
+import time
+import config
+
+
+# 集計対象のイベントと計測点
+TRACKED_EVENTS = ("page:changed", "annotation:added")
+METRICS = ("receive", "render")
+
+
+def server_timestamp() -> int:
+    """サーバー時刻 (エポックミリ秒)"""
+    return int(time.time() * 1000)
+
+
+@dataclass
+class LatencyHistogram:
+    """固定バケットの遅延ヒストグラム (ミリ秒)"""
+    bounds: List[int] = field(default_factory=lambda: list(config.LATENCY_BUCKETS_MS))
+    counts: List[int] = None
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+
+    def __post_init__(self):
+        if self.counts is None:
+            # 最後のバケットは上限超過分
+            self.counts = [0] * (len(self.bounds) + 1)
+
+    def add(self, value_ms: float):
+        """1サンプル追加"""
+        index = len(self.bounds)
+        for i, bound in enumerate(self.bounds):
+            if value_ms <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ms += value_ms
+        self.max_ms = max(self.max_ms, value_ms)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """パーセンタイル (該当バケットの上限で近似、上限超過分は最大値)"""
+        if not self.count:
+            return None
+        threshold = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= threshold:
+                return float(self.bounds[i]) if i < len(self.bounds) else self.max_ms
+        return self.max_ms
+
+    def to_dict(self):
+        data = asdict(self)
+        data["mean_ms"] = round(self.total_ms / self.count, 1) if self.count else None
+        data["p50_ms"] = self.percentile(50)
+        data["p95_ms"] = self.percentile(95)
+        return data
+
+
+class LatencyTracker:
+    """
+    ルーム×イベント×計測点ごとの遅延ヒストグラム
+
+    クライアントはサーバー時刻に補正した受信・描画時刻をまとめて報告する。
+    遅延は配信時のserver_tsとの差で、時計ずれによる負値は0として扱う。
+    """
+
+    def __init__(self):
+        self.rooms: Dict[str, Dict[str, Dict[str, LatencyHistogram]]] = {}
+        self._lock = threading.Lock()
+
+    def record_samples(self, room_id: str, samples: List[dict]) -> int:
+        """
+        クライアントのサンプルを集計
+
+        Args:
+            samples: [{"event", "seq", "server_ts", "received_at", "rendered_at"}, ...]
+        Returns:
+            集計したサンプル数
+        """
+        recorded = 0
+        with self._lock:
+            room = self.rooms.setdefault(room_id, {})
+            for sample in samples[:config.LATENCY_MAX_BATCH]:
+                if not isinstance(sample, dict):
+                    continue
+                event = sample.get("event")
+                server_ts = sample.get("server_ts")
+                if event not in TRACKED_EVENTS or not isinstance(server_ts, (int, float)):
+                    continue
+
+                histograms = room.setdefault(event, {m: LatencyHistogram() for m in METRICS})
+                for metric, key in (("receive", "received_at"), ("render", "rendered_at")):
+                    value = sample.get(key)
+                    if not isinstance(value, (int, float)):
+                        continue
+                    latency = max(0.0, value - server_ts)
+                    if latency <= config.LATENCY_MAX_MS:
+                        histograms[metric].add(latency)
+                recorded += 1
+        return recorded
+
+    def forget(self, room_id: str):
+        """ルームの集計を破棄 (ルームをメモリから追い出したとき)"""
+        with self._lock:
+            self.rooms.pop(room_id, None)
+
+    def get_room_stats(self, room_id: str) -> Optional[dict]:
+        """ルームの遅延ヒストグラム"""
+        with self._lock:
+            room = self.rooms.get(room_id)
+            if room is None:
+                return None
+            return {
+                event: {metric: h.to_dict() for metric, h in histograms.items()}
+                for event, histograms in room.items()
+            }
+
+    def get_all_stats(self) -> Dict[str, dict]:
+        """全ルームの遅延ヒストグラム"""
+        with self._lock:
+            room_ids = list(self.rooms)
+        return {room_id: self.get_room_stats(room_id) for room_id in room_ids}
+
+    def correlate_with_feedback(self, feedbacks: List[dict]) -> List[dict]:
+        """
+        ルームごとのページ同期遅延と体感評価 (rating_sync_speed) の対応表
+
+        Returns:
+            [{"room_id", "samples", "p50_ms", "p95_ms", "rating_sync_speed", "feedback_count"}, ...]
+        """
+        ratings: Dict[str, List[int]] = {}
+        for fb in feedbacks:
+            if fb.get("rating_sync_speed") is not None:
+                ratings.setdefault(fb["room_id"], []).append(fb["rating_sync_speed"])
+
+        rows = []
+        with self._lock:
+            for room_id, room in self.rooms.items():
+                histogram = room.get("page:changed", {}).get("render")
+                if not histogram or not histogram.count:
+                    continue
+                room_ratings = ratings.get(room_id, [])
+                rows.append({
+                    "room_id": room_id,
+                    "samples": histogram.count,
+                    "p50_ms": histogram.percentile(50),
+                    "p95_ms": histogram.percentile(95),
+                    "rating_sync_speed": round(sum(room_ratings) / len(room_ratings), 2) if room_ratings else None,
+                    "feedback_count": len(room_ratings)
+                })
+        return sorted(rows, key=lambda r: r["p95_ms"], reverse=True)
+
+
+# グローバルインスタンス
+latency_tracker = LatencyTracker()
@@ -0,0 +1,327 @@
+"""
+講義記録モジュール - ルームイベントの追記ログとキーフレームによる再生・シーク
+"""
+from bisect import bisect_right
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, unquote
+import atexit
+import json
+import logging
+import queue
+import shutil
+import threading
+import time
+import config
+from lib.event_log import log_event
+
+
+# 記録対象のイベント (ルームの見た目を変えるもの)
+RECORDED_EVENTS = (
+    "page:changed", "sync:toggled",
+    "annotation:added", "annotation:removed", "annotation:cleared",
+    "important:show", "important:hide"
+)
+
+
+def now_ms() -> int:
+    """現在時刻 (エポックミリ秒)"""
+    return int(time.time() * 1000)
+
+
+def initial_state(room) -> dict:
+    """ルームの現在状態から再生用の状態を作る"""
+    return {
+        "current_page": room.current_page,
+        "sync_enabled": room.sync_enabled,
+        "annotations": [a.to_dict(binary=False) for a in room.annotations],
+        "important": None
+    }
+
+
+def apply_event(state: dict, event: str, data: dict):
+    """
+    イベントを状態に適用
+
+    同じイベントを2回適用しても結果が変わらないようにする
+    (記録開始時の状態にその契機のイベントが既に反映されているため)
+    """
+    if event == "page:changed":
+        state["current_page"] = data["page_number"]
+    elif event == "sync:toggled":
+        state["sync_enabled"] = data["enabled"]
+    elif event == "annotation:added":
+        state["annotations"] = [a for a in state["annotations"] if a["id"] != data["id"]]
+        state["annotations"].append(data)
+    elif event == "annotation:removed":
+        state["annotations"] = [a for a in state["annotations"] if a["id"] != data["id"]]
+    elif event == "annotation:cleared":
+        state["annotations"] = []
+    elif event == "important:show":
+        state["important"] = data
+    elif event == "important:hide":
+        state["important"] = None
+
+
+class Recording:
+    """
+    1ルーム分の記録
+
+    events.jsonl: 1行1イベント {"t", "event", "data"} の追記ログ
+    keyframes.jsonl: 一定間隔の状態スナップショット {"t", "offset", "state"}
+        offsetはそのキーフレーム直後のイベントのevents.jsonl上の位置
+
+    シークは直前のキーフレームを読み、そこから対象時刻までのイベントだけを適用する。
+    キーフレーム間のイベント数には上限があるため、講義の長さによらず一定時間で済む。
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.events_path = self.directory / "events.jsonl"
+        self.keyframes_path = self.directory / "keyframes.jsonl"
+        self.state: Optional[dict] = None
+        # 開始時の状態を書き込み待ちに渡したか (書き込みはLectureRecorderのスレッドで行う)
+        self.started = False
+        self.last_keyframe_t = 0
+        self.events_since_keyframe = 0
+        # キーフレームの (時刻, keyframes.jsonl上の位置)
+        self.keyframe_index: Optional[List[Tuple[int, int]]] = None
+        self._lock = threading.Lock()
+
+    def record(self, initial: Optional[dict], event: str, data: dict, t: int):
+        """
+        イベントを追記 (必要ならキーフレームも書く)
+
+        Args:
+            initial: 記録開始時のルームの状態 (記録中ならNone)
+        """
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+            # 記録開始・サーバー再起動後の再開はルームの現在状態から始める
+            # (削除された記録に宛てた書き込み待ちは捨てる)
+            if self.state is None:
+                if initial is None:
+                    return
+                self.state = initial
+                self._write_keyframe(t)
+
+            with open(self.events_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"t": t, "event": event, "data": data},
+                                   ensure_ascii=False, separators=(",", ":")) + "\n")
+
+            apply_event(self.state, event, data)
+            self.events_since_keyframe += 1
+
+            if (t - self.last_keyframe_t >= config.RECORDING_KEYFRAME_INTERVAL * 1000 or
+                    self.events_since_keyframe >= config.RECORDING_KEYFRAME_EVENTS):
+                self._write_keyframe(t)
+
+    def info(self) -> Optional[dict]:
+        """記録の開始・終了時刻"""
+        with self._lock:
+            index = self._load_keyframe_index()
+            if not index:
+                return None
+            return {
+                "start": index[0][0],
+                "end": self._last_event_time() or index[-1][0],
+                "keyframes": len(index)
+            }
+
+    def seek(self, t: int) -> Optional[Tuple[dict, int]]:
+        """
+        時刻tの状態
+
+        Returns:
+            (状態, 続きのイベントのevents.jsonl上の位置)
+        """
+        with self._lock:
+            index = self._load_keyframe_index()
+            if not index:
+                return None
+
+            i = max(0, bisect_right(index, (t, float("inf"))) - 1)
+            with open(self.keyframes_path, "rb") as f:
+                f.seek(index[i][1])
+                keyframe = json.loads(f.readline())
+
+            state = keyframe["state"]
+            offset = keyframe["offset"]
+            if not self.events_path.exists():
+                return state, offset
+
+            with open(self.events_path, "rb") as f:
+                f.seek(offset)
+                for line in iter(f.readline, b""):
+                    record = json.loads(line)
+                    if record["t"] > t:
+                        break
+                    apply_event(state, record["event"], record["data"])
+                    offset = f.tell()
+            return state, offset
+
+    def iter_events(self, offset: int) -> Iterator[dict]:
+        """位置offset以降のイベントを順に読む"""
+        with open(self.events_path, "rb") as f:
+            f.seek(offset)
+            for line in iter(f.readline, b""):
+                yield json.loads(line)
+
+    def _write_keyframe(self, t: int):
+        """現在の状態をキーフレームとして書き出す"""
+        offset = self.events_path.stat().st_size if self.events_path.exists() else 0
+        line = json.dumps({"t": t, "offset": offset, "state": self.state},
+                          ensure_ascii=False, separators=(",", ":")) + "\n"
+
+        with open(self.keyframes_path, "ab") as f:
+            position = f.tell()
+            f.write(line.encode("utf-8"))
+
+        if self.keyframe_index is not None:
+            self.keyframe_index.append((t, position))
+        self.last_keyframe_t = t
+        self.events_since_keyframe = 0
+
+    def _load_keyframe_index(self) -> List[Tuple[int, int]]:
+        """キーフレームの索引 (初回のみファイルを走査する)"""
+        if self.keyframe_index is None:
+            self.keyframe_index = []
+            if self.keyframes_path.exists():
+                with open(self.keyframes_path, "rb") as f:
+                    position = 0
+                    for line in iter(f.readline, b""):
+                        self.keyframe_index.append((json.loads(line)["t"], position))
+                        position = f.tell()
+        return self.keyframe_index
+
+    def _last_event_time(self) -> Optional[int]:
+        """最後のイベントの時刻 (ファイル末尾だけ読む)"""
+        if not self.events_path.exists():
+            return None
+        with open(self.events_path, "rb") as f:
+            f.seek(0, 2)
+            size = f.tell()
+            f.seek(max(0, size - 64 * 1024))
+            lines = f.read().splitlines()
+        return json.loads(lines[-1])["t"] if lines else None
+
+
+class LectureRecorder:
+    """
+    ルームごとの記録の管理
+
+    ファイルへの追記・キーフレームの書き出しは専用スレッドで行い、
+    ハンドラはキューに積むだけで戻る
+    """
+
+    def __init__(self, recordings_dir: Optional[Path]):
+        """
+        Args:
+            recordings_dir: 記録の保存先 (Noneなら記録しない)
+        """
+        self.recordings_dir = Path(recordings_dir) if recordings_dir else None
+        self.recordings: Dict[str, Recording] = {}
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+
+    def record(self, room, event: str, data: dict, t: int = None):
+        """
+        ルームイベントを記録
+
+        Args:
+            data: JSONに変換できる配信データ (遅延計測用のserver_ts・seqは除いて保存)
+        """
+        if not self.recordings_dir or event not in RECORDED_EVENTS:
+            return
+        data = {k: v for k, v in (data or {}).items() if k not in ("server_ts", "seq")}
+        recording = self.get_recording(room.room_id, create=True)
+
+        # 開始時の状態はルームから写し取っておく (書き込みスレッドからルームは触らない)
+        initial = None
+        with recording._lock:
+            if not recording.started:
+                recording.started = True
+                initial = initial_state(room)
+
+        self._ensure_writer()
+        self._queue.put((recording, initial, event, data, t or now_ms()))
+
+    def forget(self, room_id: str):
+        """記録をメモリから外す (ルームをメモリから追い出したとき、ファイルは残す)"""
+        with self._lock:
+            self.recordings.pop(room_id, None)
+
+    def flush(self):
+        """書き込み待ちのイベントを書き終えて書き込みスレッドを止める"""
+        if self._writer:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+    def _ensure_writer(self):
+        """書き込みスレッドを起動 (初回のみ)"""
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="lecture-recorder", daemon=True)
+                self._writer.start()
+                atexit.register(self.flush)
+
+    def _write_loop(self):
+        """キューのイベントを順にファイルへ書く"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            recording, initial, event, data, t = item
+            try:
+                recording.record(initial, event, data, t)
+            except Exception as e:
+                log_event("recording:write_failed", logging.ERROR, directory=str(recording.directory), error=str(e))
+
+    def get_recording(self, room_id: str, create: bool = False) -> Optional[Recording]:
+        """記録取得 (create=Falseなら記録のないルームはNone)"""
+        if not self.recordings_dir or not room_id:
+            return None
+        with self._lock:
+            recording = self.recordings.get(room_id)
+            if recording is None:
+                directory = self.recordings_dir / quote(room_id, safe="")
+                if not create and not directory.exists():
+                    return None
+                recording = self.recordings[room_id] = Recording(directory)
+            return recording
+
+    def purge_recordings(self, retention: float) -> int:
+        """最後の記録から一定期間経った記録を削除"""
+        if not self.recordings_dir or not self.recordings_dir.exists():
+            return 0
+
+        cutoff = time.time() - retention
+        purged = 0
+        for directory in self.recordings_dir.iterdir():
+            if not directory.is_dir():
+                continue
+            events_path = directory / "events.jsonl"
+            last_written = (events_path if events_path.exists() else directory).stat().st_mtime
+            if last_written >= cutoff:
+                continue
+
+            with self._lock:
+                recording = self.recordings.pop(unquote(directory.name), None)
+            if recording:
+                # 参照を持ったまま記録が再開されてもキーフレームから書き直させる
+                with recording._lock:
+                    shutil.rmtree(directory, ignore_errors=True)
+                    recording.state = None
+                    recording.started = False
+                    recording.keyframe_index = None
+            else:
+                shutil.rmtree(directory, ignore_errors=True)
+            purged += 1
+        return purged
+
+
+# グローバルインスタンス
+lecture_recorder = LectureRecorder(config.RECORDING_DIR if config.RECORDING_ENABLED else None)
@@ -0,0 +1,149 @@
+"""
+教材メタデータ管理モジュール - metadata.jsonのキャッシュとページ参照
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+import json
+import threading
+import config
+
+
+# 一覧・要約に含めるページのフィールド (注釈・用語などの本文は含めない)
+SUMMARY_PAGE_FIELDS = ("page_number", "image_url", "thumbnail_url")
+SUMMARY_FIELDS = ("id", "title", "category", "status", "total_pages", "pages_ready",
+                  "chapters", "thumbnail_atlas")
+
+
+@dataclass
+class MaterialIndex:
+    """1教材分の読み込み済みインデックス"""
+    mtime: int
+    metadata: dict
+    pages: Dict[int, dict]
+    summary: dict
+
+    @classmethod
+    def build(cls, mtime: int, metadata: dict) -> "MaterialIndex":
+        pages = {p["page_number"]: p for p in metadata.get("pages", [])}
+        summary = {k: metadata[k] for k in SUMMARY_FIELDS if k in metadata}
+        summary["pages"] = [
+            {k: p.get(k) for k in SUMMARY_PAGE_FIELDS}
+            for p in metadata.get("pages", [])
+        ]
+        return cls(mtime=mtime, metadata=metadata, pages=pages, summary=summary)
+
+
+class MaterialStore:
+    """教材メタデータのキャッシュ (metadata.jsonの更新時刻で自動再読み込み)"""
+
+    def __init__(self, materials_dir: Path):
+        self.materials_dir = Path(materials_dir)
+        self._cache: Dict[str, MaterialIndex] = {}
+        self._lock = threading.Lock()
+
+    def get_metadata(self, material_id: str) -> Optional[dict]:
+        """教材メタデータ取得 (存在しなければNone)"""
+        index = self._get_index(material_id)
+        return index.metadata if index else None
+
+    def get_summary(self, material_id: str) -> Optional[dict]:
+        """
+        教材の要約 (タイトル・ページ数・各ページの画像URLのみ)
+
+        ページごとのノート・用語・チェックリスト等はget_pageで個別に取得する
+        """
+        index = self._get_index(material_id)
+        return index.summary if index else None
+
+    def get_page(self, material_id: str, page_number: int) -> Optional[dict]:
+        """1ページ分のメタデータ取得"""
+        index = self._get_index(material_id)
+        return index.pages.get(page_number) if index else None
+
+    def get_prefetch_hints(self, material_id: str, page_number: int,
+                           count: int = None) -> List[dict]:
+        """
+        指定ページの次のcountページ分の先読みヒント
+
+        Returns:
+            [{"page_number", "image_url", "thumbnail_url"}, ...]
+        """
+        if count is None:
+            count = config.PREFETCH_PAGE_COUNT
+
+        index = self._get_index(material_id)
+        if not index or count <= 0:
+            return []
+
+        upcoming = (index.pages.get(n) for n in range(page_number + 1, page_number + count + 1))
+        return [self._page_assets(p) for p in upcoming if p]
+
+    def get_preload_manifest(self, material_id: str, start_page: int = 1) -> Optional[dict]:
+        """
+        教材全体の先読みマニフェスト
+
+        start_pageから順に並べ、それより前のページを末尾に回す
+        (講義の進行順にダウンロードさせるため)
+        """
+        metadata = self.get_metadata(material_id)
+        if not metadata:
+            return None
+
+        pages = metadata.get("pages", [])
+        ordered = ([p for p in pages if p["page_number"] >= start_page] +
+                   [p for p in pages if p["page_number"] < start_page])
+
+        return {
+            "material_id": material_id,
+            "total_pages": metadata.get("total_pages", len(pages)),
+            "pages": [self._page_assets(p) for p in ordered]
+        }
+
+    def _page_assets(self, page: dict) -> dict:
+        """ページの画像URL群"""
+        return {
+            "page_number": page["page_number"],
+            "image_url": page.get("image_url"),
+            "thumbnail_url": page.get("thumbnail_url")
+        }
+
+    def _get_index(self, material_id: str) -> Optional[MaterialIndex]:
+        """教材インデックス取得 (metadata.jsonが更新されていれば作り直す)"""
+        metadata_path = self._metadata_path(material_id)
+        if not metadata_path:
+            return None
+
+        try:
+            mtime = metadata_path.stat().st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            self._cache.pop(material_id, None)
+            return None
+
+        cached = self._cache.get(material_id)
+        if cached and cached.mtime == mtime:
+            return cached
+
+        with self._lock:
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+            index = MaterialIndex.build(mtime, metadata)
+            self._cache[material_id] = index
+
+        return index
+
+    @staticmethod
+    def is_valid_id(material_id: str) -> bool:
+        """教材ディレクトリ直下の1階層を指すIDか"""
+        return bool(material_id) and material_id not in (".", "..") and \
+            "/" not in material_id and "\\" not in material_id
+
+    def _metadata_path(self, material_id: str) -> Optional[Path]:
+        """metadata.jsonパス (教材ディレクトリ外を指すIDはNone)"""
+        if not self.is_valid_id(material_id):
+            return None
+        return self.materials_dir / material_id / "metadata.json"
+
+
+# グローバルインスタンス
+material_store = MaterialStore(config.MATERIALS_DIR)
@@ -4,9 +4,17 @@ PDF処理モジュール - PyMuPDFを使用した高品質変換
 import fitz  # PyMuPDF
 from pathlib import Path
 from PIL import Image
+import base64
+import io
 import json
-from typing import Dict, List, Tuple
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
 import config
+from lib.asset_store import asset_store, url_to_path
+from lib.atomic_io import write_json_atomic
+from lib.deck_bundle import build_bundle, build_precache
+from lib.search_index import search_index
 
 
 class PDFProcessor:
@@ -24,13 +32,19 @@ class PDFProcessor:
         self.pages_dir = self.output_dir / "pages"
         self.thumbs_dir = self.output_dir / "thumbs"
         
-    def convert(self) -> Dict:
+    def convert(self, progress_callback: Optional[Callable[[int, int], None]] = None) -> Dict:
         """
         PDF全ページを画像化し、メタデータを生成
         
+        Args:
+            progress_callback: 1ページ処理するごとに (処理済みページ数, 総ページ数) で呼ばれる
+        
         Returns:
             教材メタデータ辞書
         """
+        # 公開中の教材の再変換では途中経過を公開しない (講義中の教材のページが欠けるため)
+        self.replacing = self._published_status() == "ready"
+        
         # ディレクトリ作成
         self.pages_dir.mkdir(parents=True, exist_ok=True)
         self.thumbs_dir.mkdir(parents=True, exist_ok=True)
@@ -39,70 +53,165 @@ class PDFProcessor:
         doc = fitz.open(self.pdf_path)
         total_pages = len(doc)
         
-        pages_metadata = []
-        
-        for page_num in range(total_pages):
-            page = doc[page_num]
-            page_id = f"{page_num + 1:03d}"
-            
-            # ページ画像生成 (高解像度)
-            page_img_path = self.pages_dir / f"{page_id}.{config.MATERIAL_PAGE_FORMAT}"
-            self._render_page(page, page_img_path, config.MATERIAL_PAGE_MAX_WIDTH)
-            
-            # サムネイル生成
-            thumb_img_path = self.thumbs_dir / f"{page_id}.{config.MATERIAL_PAGE_FORMAT}"
-            self._render_page(page, thumb_img_path, config.MATERIAL_THUMB_WIDTH)
-            
-            # ページメタデータ
-            pages_metadata.append({
-                "page_number": page_num + 1,
-                "page_id": page_id,
-                "image_url": f"/static/materials/{self.material_id}/pages/{page_id}.{config.MATERIAL_PAGE_FORMAT}",
-                "thumbnail_url": f"/static/materials/{self.material_id}/thumbs/{page_id}.{config.MATERIAL_PAGE_FORMAT}",
-                "instructor_notes": [],
-                "glossary": [],
-                "checklist": [],
-                "highlights": []
-            })
-        
-        doc.close()
-        
-        # 教材メタデータ
+        # 教材メタデータ (変換中も途中経過を公開する)
         material_metadata = {
             "id": self.material_id,
             "title": self.pdf_path.stem,
             "category": self._detect_category(self.pdf_path.stem),
+            "status": "converting",
             "total_pages": total_pages,
-            "pages": pages_metadata,
+            "pages_ready": 0,
+            "pages": [],
             "chapters": []  # 後で手動追加
         }
+        pages_text = []
+        last_published = 0.0
         
-        # メタデータ保存
-        metadata_path = self.output_dir / "metadata.json"
-        with open(metadata_path, "w", encoding="utf-8") as f:
-            json.dump(material_metadata, f, ensure_ascii=False, indent=2)
+        try:
+            for page_num in range(total_pages):
+                page = doc[page_num]
+                page_id = f"{page_num + 1:03d}"
+                
+                # 1度だけラスタライズし、ページ画像とサムネイルを作る
+                rendered = self._rasterize(page)
+                
+                # ページ画像生成 (高解像度)
+                image_url, image_hash = self._save_image(
+                    rendered, config.MATERIAL_PAGE_MAX_WIDTH, self.pages_dir, page_id)
+                
+                # 本文抽出 (全文検索用)
+                pages_text.append((page_num + 1, page.get_text("text")))
+                
+                # サムネイル生成
+                thumbnail_url, thumbnail_hash = self._save_image(
+                    rendered, config.MATERIAL_THUMB_WIDTH, self.thumbs_dir, page_id)
+                
+                # 低画質プレースホルダー (本画像の到着前に表示する)
+                placeholder = make_placeholder(rendered)
+                
+                # ページメタデータ
+                material_metadata["pages"].append({
+                    "page_number": page_num + 1,
+                    "page_id": page_id,
+                    "image_url": image_url,
+                    "thumbnail_url": thumbnail_url,
+                    "image_hash": image_hash,
+                    "thumbnail_hash": thumbnail_hash,
+                    "placeholder": placeholder,
+                    "instructor_notes": [],
+                    "glossary": [],
+                    "checklist": [],
+                    "highlights": []
+                })
+                material_metadata["pages_ready"] = page_num + 1
+                
+                # 1ページ目は即座に、以降は一定間隔で途中経過を書き出す
+                now = time.monotonic()
+                if page_num == 0 or now - last_published >= config.METADATA_PUBLISH_INTERVAL:
+                    self._write_metadata(material_metadata)
+                    last_published = now
+                
+                # 1ページ目が書き出された時点で教材一覧に載せる
+                if page_num == 0 and not self.replacing:
+                    update_manifest_entry(config.MATERIALS_DIR, material_metadata)
+                
+                if progress_callback:
+                    progress_callback(page_num + 1, total_pages)
+            
+            # サムネイルを1枚のスプライトにまとめる (個別サムネイルはフォールバック用に残す)
+            material_metadata["thumbnail_atlas"] = build_thumbnail_atlas(self.output_dir, material_metadata)
+            
+            # 全文検索インデックス登録
+            search_index.add_material(self.material_id, material_metadata["title"], pages_text)
+            search_index.save()
+            
+            # メタデータ保存
+            material_metadata["status"] = "ready"
+            self._write_metadata(material_metadata, final=True)
+            update_manifest_entry(config.MATERIALS_DIR, material_metadata)
+        except Exception as e:
+            self._mark_failed(material_metadata, e)
+            raise
+        finally:
+            doc.close()
+        
+        # 講義前の事前キャッシュ用マニフェスト (バンドルは無効時は初回リクエストで生成)
+        build_precache(self.output_dir, material_metadata)
+        if config.DECK_BUNDLE_ON_CONVERT:
+            build_bundle(self.output_dir, material_metadata)
         
         print(f"✓ 変換完了: {self.material_id} ({total_pages}ページ)")
         
         return material_metadata
     
-    def _render_page(self, page: fitz.Page, output_path: Path, max_width: int):
-        """ページを画像化"""
+    def _published_status(self) -> Optional[str]:
+        """公開中のmetadata.jsonのstatus (無ければNone)"""
+        try:
+            with open(self.output_dir / "metadata.json", "r", encoding="utf-8") as f:
+                return json.load(f).get("status", "ready")
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+    
+    def _mark_failed(self, material_metadata: Dict, error: Exception):
+        """
+        変換失敗の反映
+        
+        再変換なら公開中のメタデータは残して途中経過だけ捨てる。
+        それ以外はstatus: "error"を書き、変換中のまま残らないようにする
+        (同じ教材IDでの再アップロードを受け付ける)
+        """
+        if self.replacing:
+            (self.output_dir / "metadata.converting.json").unlink(missing_ok=True)
+            return
+        
+        material_metadata["status"] = "error"
+        material_metadata["error"] = str(error)
+        self._write_metadata(material_metadata, final=True)
+        if material_metadata["pages_ready"]:
+            update_manifest_entry(config.MATERIALS_DIR, material_metadata)
+    
+    def _write_metadata(self, material_metadata: Dict, final: bool = False):
+        """
+        metadata.jsonをアトミックに書き出す (変換中に読まれても壊れない)
+        
+        再変換中の途中経過はmetadata.converting.jsonに書き、完了時に差し替える
+        """
+        staging_path = self.output_dir / "metadata.converting.json"
+        if self.replacing and not final:
+            write_json_atomic(staging_path, material_metadata)
+            return
+        
+        write_json_atomic(self.output_dir / "metadata.json", material_metadata)
+        staging_path.unlink(missing_ok=True)
+    
+    def _rasterize(self, page: fitz.Page) -> Image.Image:
+        """ページをPIL Imageにラスタライズ"""
         # ズーム係数計算
         mat = fitz.Matrix(2.0, 2.0)  # 2倍解像度でレンダリング
         pix = page.get_pixmap(matrix=mat, alpha=False)
         
         # PIL Imageに変換
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    
+    def _save_image(self, img: Image.Image, max_width: int, output_dir: Path,
+                    page_id: str) -> Tuple[str, Optional[str]]:
+        """
+        指定幅の画像を保存
+        
+        アセットストア有効時は内容ハッシュで保存し、教材ディレクトリには書かない。
+        
+        Returns:
+            (画像URL, ハッシュ)  ハッシュはアセットストア無効時None
+        """
+        data = encode_image(img, max_width)
         
-        # リサイズ
-        if img.width > max_width:
-            ratio = max_width / img.width
-            new_height = int(img.height * ratio)
-            img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
+        if config.ASSET_STORE_ENABLED:
+            digest, url = asset_store.put(data, config.MATERIAL_PAGE_FORMAT)
+            return url, digest
         
-        # 保存
-        img.save(output_path, quality=config.MATERIAL_QUALITY, optimize=True)
+        filename = f"{page_id}.{config.MATERIAL_PAGE_FORMAT}"
+        (output_dir / filename).write_bytes(data)
+        return f"/static/materials/{self.material_id}/{output_dir.name}/{filename}", None
     
     def _detect_category(self, filename: str) -> str:
         """ファイル名からカテゴリ判定"""
@@ -126,9 +235,121 @@ class PDFProcessor:
             return "general"
 
 
+def encode_image(img: Image.Image, max_width: int) -> bytes:
+    """画像を最大幅に縮小してエンコード"""
+    # リサイズ
+    if img.width > max_width:
+        ratio = max_width / img.width
+        new_height = int(img.height * ratio)
+        img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
+    
+    # 保存
+    buffer = io.BytesIO()
+    img.save(buffer, format=Image.registered_extensions()[f".{config.MATERIAL_PAGE_FORMAT}"],
+             quality=config.MATERIAL_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def make_placeholder(img: Image.Image) -> str:
+    """
+    極小のプログレッシブJPEGをdata URIにした低画質プレースホルダー (約1KB)
+    
+    クライアントはぼかして表示し、本画像が届いたら差し替える
+    """
+    width = config.PLACEHOLDER_WIDTH
+    height = max(1, round(img.height * width / img.width))
+    small = img.convert("RGB").resize((width, height), Image.Resampling.BILINEAR)
+    
+    buffer = io.BytesIO()
+    small.save(buffer, format="JPEG", quality=config.PLACEHOLDER_QUALITY, optimize=True, progressive=True)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def build_placeholders(metadata: Dict) -> int:
+    """
+    変換済み教材の各ページにプレースホルダーを付与 (ページ画像から生成)
+    
+    Returns:
+        生成したページ数
+    """
+    count = 0
+    for page in metadata["pages"]:
+        with Image.open(url_to_path(page["image_url"])) as img:
+            page["placeholder"] = make_placeholder(img)
+        count += 1
+    return count
+
+
+def extract_pages_text(pdf_path: Path) -> List[Tuple[int, str]]:
+    """PDFの全ページの本文 (全文検索の再索引用、画像化はしない)"""
+    with fitz.open(pdf_path) as doc:
+        return [(page.number + 1, page.get_text("text")) for page in doc]
+
+
+def material_id_from_filename(filename: str) -> str:
+    """PDFファイル名から教材IDを生成"""
+    return Path(filename).stem.replace(" ", "_").replace("(", "").replace(")", "")
+
+
+def build_thumbnail_atlas(material_dir: Path, metadata: Dict) -> Dict:
+    """
+    全ページのサムネイルをグリッド状に並べたスプライト画像を生成
+    
+    Args:
+        material_dir: 教材ディレクトリ
+        metadata: 教材メタデータ (pagesのthumbnail_urlを参照)
+        
+    Returns:
+        スプライト情報 {"url", "width", "height", "tiles": [{"page_number", "x", "y", "width", "height"}]}
+    """
+    thumbs = []
+    for page in metadata["pages"]:
+        with Image.open(url_to_path(page["thumbnail_url"])) as img:
+            thumbs.append((page["page_number"], img.convert("RGB")))
+    
+    if not thumbs:
+        return {}
+    
+    columns = min(config.THUMB_ATLAS_COLUMNS, len(thumbs))
+    rows = (len(thumbs) + columns - 1) // columns
+    cell_width = max(img.width for _, img in thumbs)
+    cell_height = max(img.height for _, img in thumbs)
+    
+    atlas = Image.new("RGB", (cell_width * columns, cell_height * rows), "white")
+    tiles = []
+    for index, (page_number, img) in enumerate(thumbs):
+        x = (index % columns) * cell_width
+        y = (index // columns) * cell_height
+        atlas.paste(img, (x, y))
+        tiles.append({
+            "page_number": page_number,
+            "x": x,
+            "y": y,
+            "width": img.width,
+            "height": img.height
+        })
+    
+    data = encode_image(atlas, atlas.width)
+    if config.ASSET_STORE_ENABLED:
+        digest, url = asset_store.put(data, config.MATERIAL_PAGE_FORMAT)
+    else:
+        atlas_path = material_dir / "thumbs" / f"atlas.{config.MATERIAL_PAGE_FORMAT}"
+        atlas_path.parent.mkdir(parents=True, exist_ok=True)
+        atlas_path.write_bytes(data)
+        digest, url = None, f"/static/materials/{material_dir.name}/thumbs/{atlas_path.name}"
+    
+    return {
+        "url": url,
+        "hash": digest,
+        "width": atlas.width,
+        "height": atlas.height,
+        "tiles": tiles
+    }
+
+
 def generate_manifest(materials_dir: Path) -> Dict:
     """
-    全教材のmanifest.jsonを生成
+    全教材のmanifest.jsonを生成 (全ディレクトリを走査する完全再構築)
     
     Args:
         materials_dir: 教材ディレクトリ
@@ -149,18 +370,124 @@ def generate_manifest(materials_dir: Path) -> Dict:
         if metadata_path.exists():
             with open(metadata_path, "r", encoding="utf-8") as f:
                 metadata = json.load(f)
-                manifest["materials"].append({
-                    "id": metadata["id"],
-                    "title": metadata["title"],
-                    "category": metadata["category"],
-                    "total_pages": metadata["total_pages"]
-                })
+                manifest["materials"].append(_manifest_entry(metadata, material_dir))
     
     # manifest.json保存
-    manifest_path = materials_dir / "manifest.json"
-    with open(manifest_path, "w", encoding="utf-8") as f:
-        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    with _manifest_lock:
+        write_json_atomic(materials_dir / "manifest.json", manifest)
     
     print(f"✓ Manifest生成完了: {len(manifest['materials'])}教材")
     
     return manifest
+
+
+def update_manifest_entry(materials_dir: Path, metadata: Dict) -> Dict:
+    """
+    manifest.jsonの1教材分だけを追加・更新
+    
+    Args:
+        materials_dir: 教材ディレクトリ
+        metadata: 教材メタデータ
+        
+    Returns:
+        更新後のmanifest辞書
+    """
+    entry = _manifest_entry(metadata, materials_dir / metadata["id"])
+    
+    with _manifest_lock:
+        manifest = load_manifest_file(materials_dir)
+        materials = manifest["materials"]
+        
+        for i, existing in enumerate(materials):
+            if existing["id"] == entry["id"]:
+                materials[i] = entry
+                break
+        else:
+            materials.append(entry)
+        
+        write_json_atomic(materials_dir / "manifest.json", manifest)
+    
+    return manifest
+
+
+def remove_manifest_entry(materials_dir: Path, material_id: str) -> Dict:
+    """manifest.jsonから1教材分を削除"""
+    with _manifest_lock:
+        manifest = load_manifest_file(materials_dir)
+        manifest["materials"] = [m for m in manifest["materials"] if m["id"] != material_id]
+        write_json_atomic(materials_dir / "manifest.json", manifest)
+    
+    return manifest
+
+
+def check_manifest(materials_dir: Path) -> Dict:
+    """
+    manifest.jsonとディレクトリの整合性を確認し、差分だけ修正
+    
+    各教材ディレクトリのmtime (metadata.jsonのアトミック置き換えで更新される) を
+    manifestの記録と比べ、変化したディレクトリのmetadata.jsonだけを読み直す。
+    
+    Returns:
+        {"added": [...], "updated": [...], "removed": [...]}
+    """
+    changes = {"added": [], "updated": [], "removed": []}
+    
+    with _manifest_lock:
+        manifest = load_manifest_file(materials_dir)
+        entries = {m["id"]: m for m in manifest["materials"]}
+        seen = set()
+        
+        for material_dir in materials_dir.iterdir():
+            if not material_dir.is_dir():
+                continue
+            
+            entry = entries.get(material_dir.name)
+            if entry and entry.get("mtime") == material_dir.stat().st_mtime_ns:
+                seen.add(material_dir.name)
+                continue
+            
+            metadata_path = material_dir / "metadata.json"
+            if not metadata_path.exists():
+                continue
+            
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+            
+            entries[metadata["id"]] = _manifest_entry(metadata, material_dir)
+            seen.add(metadata["id"])
+            changes["updated" if entry else "added"].append(metadata["id"])
+        
+        changes["removed"] = [material_id for material_id in entries if material_id not in seen]
+        
+        if any(changes.values()):
+            manifest["materials"] = [e for material_id, e in entries.items() if material_id in seen]
+            write_json_atomic(materials_dir / "manifest.json", manifest)
+    
+    return changes
+
+
+def load_manifest_file(materials_dir: Path) -> Dict:
+    """manifest.json読み込み (なければ空)"""
+    manifest_path = materials_dir / "manifest.json"
+    
+    if not manifest_path.exists():
+        return {"version": "1.0", "materials": []}
+    
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _manifest_entry(metadata: Dict, material_dir: Path) -> Dict:
+    """manifestの1教材分 (mtimeは整合性確認用)"""
+    return {
+        "id": metadata["id"],
+        "title": metadata["title"],
+        "category": metadata["category"],
+        "total_pages": metadata["total_pages"],
+        "status": metadata.get("status", "ready"),
+        "mtime": material_dir.stat().st_mtime_ns
+    }
+
+
+# manifest.jsonの読み書きを直列化 (変換ワーカーが並行して更新するため)
+_manifest_lock = threading.Lock()
@@ -0,0 +1,58 @@
+"""
+参加者プレゼンス集約モジュール - 入退室通知をルームごとにまとめて送る
+"""
+from dataclasses import dataclass, field
+from typing import Dict, List
+import threading
+
+
+@dataclass
+class PresenceDelta:
+    """1ルーム分の入退室差分"""
+    room_id: str
+    joined: Dict[str, dict] = field(default_factory=dict)  # sid -> 参加者情報
+    left: List[str] = field(default_factory=list)
+
+    def to_dict(self):
+        return {
+            "joined": list(self.joined.values()),
+            "left": self.left
+        }
+
+
+class PresenceBatcher:
+    """
+    入退室の差分バッファ
+
+    ハンドラはjoined/leftで差分を積むだけにし、送信は定期的なflushでまとめて行う。
+    同じ間隔内で参加して退出した参加者は相殺して送らない。
+    """
+
+    def __init__(self):
+        self._pending: Dict[str, PresenceDelta] = {}
+        self._lock = threading.Lock()
+
+    def joined(self, room_id: str, participant: dict):
+        """参加を記録"""
+        with self._lock:
+            delta = self._pending.setdefault(room_id, PresenceDelta(room_id))
+            if participant["id"] in delta.left:
+                delta.left.remove(participant["id"])
+            delta.joined[participant["id"]] = participant
+
+    def left(self, room_id: str, sid: str):
+        """退出を記録"""
+        with self._lock:
+            delta = self._pending.setdefault(room_id, PresenceDelta(room_id))
+            if delta.joined.pop(sid, None) is None and sid not in delta.left:
+                delta.left.append(sid)
+
+    def drain(self) -> List[PresenceDelta]:
+        """溜まった差分を取り出す (空の差分は除く)"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return [d for d in pending.values() if d.joined or d.left]
+
+
+# グローバルインスタンス
+presence_batcher = PresenceBatcher()
@@ -0,0 +1,140 @@
+"""
+サンプリングプロファイラモジュール - 稼働中のサーバーの全スレッドのスタックを定期採取
+"""
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+import sys
+import threading
+import time
+import config
+
+
+# 待機中とみなす最上段の関数 (ファイル名, 関数名)。接続ごとのスレッドの大半はここで止まっている
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("socket.py", "accept"),
+    ("socket.py", "readinto"),
+    ("ssl.py", "read"),
+    ("ssl.py", "recv_into"),
+}
+
+
+def _code_label(code) -> str:
+    """スタックの1段の表示名 (関数名 (ファイル名:行))"""
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+def _is_idle(code) -> bool:
+    """待機中のスレッドの最上段か"""
+    return (Path(code.co_filename).name, code.co_name) in IDLE_FRAMES
+
+
+class SamplingProfiler:
+    """
+    全スレッドのスタックを一定間隔で採取するプロファイラ
+
+    sys._current_frames()を読むだけなので計測対象のコードには手を入れず、
+    サーバーを止めずに開始・終了できる。結果はflamegraph.pl・speedscope等で
+    読めるcollapsed形式 ("外側;...;内側 回数" の行) で返す。
+    1度に実行できるセッションは1つだけ。
+
+    採取中はコードオブジェクトの並びを数えるだけにし、表示名への変換は結果の取得時に行う。
+    ロック・ソケット待ちで止まっているスレッドは数えない。
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        # (スレッド名, 外側→内側のコードオブジェクト) -> 回数
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at: Optional[str] = None
+        self.duration = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration: float) -> bool:
+        """採取開始 (実行中ならFalse)"""
+        with self._lock:
+            if self.running:
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.started_at = datetime.now().isoformat()
+            self.duration = duration
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(duration,),
+                                            name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """採取を打ち切る"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def status(self) -> dict:
+        """セッションの状態"""
+        return {
+            "running": self.running,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "interval": self.interval,
+            "samples": self.samples
+        }
+
+    def collapsed(self) -> str:
+        """collapsed形式の採取結果 (回数の多い順)"""
+        labels = {}
+        lines = []
+        for (thread_name, codes), count in self.stacks.most_common():
+            names = [thread_name]
+            for code in codes:
+                if code not in labels:
+                    labels[code] = _code_label(code)
+                names.append(labels[code])
+            lines.append(f"{';'.join(names)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def _run(self, duration: float):
+        """採取ループ (自スレッドは除く)"""
+        own_id = threading.get_ident()
+        names = {}
+        idle = {}
+        deadline = time.monotonic() + duration
+
+        while time.monotonic() < deadline and not self._stop.is_set():
+            if len(names) != threading.active_count():
+                names = {t.ident: t.name for t in threading.enumerate()}
+
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                code = frame.f_code
+                if code not in idle:
+                    idle[code] = _is_idle(code)
+                if idle[code]:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                codes.reverse()
+                self.stacks[(names.get(thread_id, str(thread_id)), tuple(codes))] += 1
+
+            self.samples += 1
+            self._stop.wait(self.interval)
+
+
+# グローバルインスタンス
+profiler = SamplingProfiler(config.PROFILER_SAMPLE_INTERVAL)
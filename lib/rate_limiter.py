@@ -0,0 +1,114 @@
+"""
+レート制限モジュール - 接続・イベント種別ごとのトークンバケット
+"""
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+import threading
+import time
+import config
+
+
+@dataclass
+class TokenBucket:
+    """トークンバケット (毎秒rate個補充、最大capacity個)"""
+    rate: float
+    capacity: float
+    tokens: float = None
+    updated_at: float = field(default_factory=time.monotonic)
+
+    def __post_init__(self):
+        if self.tokens is None:
+            self.tokens = self.capacity
+
+    def take(self) -> bool:
+        """トークンを1つ消費 (足りなければFalse)"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        """次のトークンが貯まるまでの秒数"""
+        self._refill()
+        if self.tokens >= 1 or self.rate <= 0:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+class RateLimiter:
+    """
+    接続ID×イベント種別ごとのレート制限
+
+    制限を超えたイベントは破棄するか、defer()で最新の1件だけ保持して後で処理する
+    (ページ送りの連打など、途中の値に意味がないイベント向け)。
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, int]], default: Tuple[float, int]):
+        self.limits = limits
+        self.default = default
+        # 切断時に接続単位でまとめて破棄できるよう sid -> {event: ...} で持つ
+        self.buckets: Dict[str, Dict[str, TokenBucket]] = {}
+        self.deferred: Dict[str, Dict[str, Any]] = {}
+        self.dropped: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def allow(self, sid: str, event: str) -> bool:
+        """イベントを処理してよいか (制限超過なら破棄数を記録してFalse)"""
+        with self._lock:
+            if self._bucket(sid, event).take():
+                return True
+            self.dropped[event] = self.dropped.get(event, 0) + 1
+            return False
+
+    def retry_after(self, sid: str, event: str) -> float:
+        """次に処理できるまでの秒数"""
+        with self._lock:
+            return self._bucket(sid, event).retry_after()
+
+    def defer(self, sid: str, event: str, data: Any) -> bool:
+        """
+        制限超過イベントを保留 (保留中のものは新しいデータで置き換える)
+
+        Returns:
+            新たに保留した場合True (呼び出し側で後処理を1回だけ予約する)
+        """
+        with self._lock:
+            pending = self.deferred.setdefault(sid, {})
+            scheduled = event in pending
+            pending[event] = data
+            return not scheduled
+
+    def pop_deferred(self, sid: str, event: str) -> Optional[Any]:
+        """保留中のデータを取り出す"""
+        with self._lock:
+            pending = self.deferred.get(sid)
+            if not pending:
+                return None
+            data = pending.pop(event, None)
+            if not pending:
+                del self.deferred[sid]
+            return data
+
+    def forget(self, sid: str):
+        """切断した接続の状態を破棄"""
+        with self._lock:
+            self.buckets.pop(sid, None)
+            self.deferred.pop(sid, None)
+
+    def _bucket(self, sid: str, event: str) -> TokenBucket:
+        buckets = self.buckets.setdefault(sid, {})
+        bucket = buckets.get(event)
+        if bucket is None:
+            rate, capacity = self.limits.get(event, self.default)
+            bucket = buckets[event] = TokenBucket(rate, capacity)
+        return bucket
+
+
+# グローバルインスタンス
+rate_limiter = RateLimiter(config.RATE_LIMITS, config.RATE_LIMIT_DEFAULT)
@@ -1,10 +1,19 @@
 """
 ルーム管理モジュール - WebSocket同期のための状態管理
 """
-from typing import Dict, List, Optional
-from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass, asdict, field
 from datetime import datetime
+from pathlib import Path
+from urllib.parse import quote
 import json
+import logging
+import threading
+import time
+import config
+from lib.atomic_io import write_json_atomic
+from lib.event_log import log_event
+from lib.stroke_codec import encode_pen_data, to_json_safe, from_json_safe
 
 
 @dataclass
@@ -29,8 +38,45 @@ class Annotation:
     timestamp: str
     temporary: bool = False
     
-    def to_dict(self):
-        return asdict(self)
+    def __post_init__(self):
+        # ペンストロークは量子化済みバイナリで保持する
+        if self.type == "pen":
+            self.data = encode_pen_data(self.data)
+    
+    def to_dict(self, binary: bool = True):
+        """
+        Args:
+            binary: Trueならbytesのまま返す (Socket.IOのバイナリ添付用)。
+                    FalseならJSON化できるようbase64に変換する
+        """
+        result = asdict(self)
+        if not binary:
+            result["data"] = to_json_safe(result["data"])
+        return result
+
+
+@dataclass
+class StrokeSession:
+    """描画中のペンストローク (stroke:begin〜stroke:end)"""
+    id: str
+    owner_sid: str
+    page_number: int
+    data: dict
+    points: List[Tuple[float, float]] = field(default_factory=list)
+    next_seq: int = 0
+    updated_at: float = field(default_factory=time.monotonic)
+    
+    def to_annotation(self) -> Annotation:
+        """確定した注釈に変換 (間引き・量子化はAnnotation側で行う)"""
+        data = dict(self.data)
+        data["points"] = self.points
+        return Annotation(
+            id=self.id,
+            page_number=self.page_number,
+            type="pen",
+            data=data,
+            timestamp=datetime.now().isoformat()
+        )
 
 
 class Room:
@@ -44,20 +90,78 @@ class Room:
         self.sync_enabled = True
         self.participants: Dict[str, Participant] = {}
         self.annotations: List[Annotation] = []
+        self.active_strokes: Dict[str, StrokeSession] = {}
         self.created_at = datetime.now().isoformat()
+        self.last_active = time.time()
+        self.seq = 0
+        # 配信用シャード (接続IDの集合) と接続ID→シャード番号
+        self.shards: List[set] = []
+        self.shard_index: Dict[str, int] = {}
     
-    def add_participant(self, participant: Participant):
-        """参加者追加"""
+    def touch(self):
+        """最終アクティブ時刻を更新 (アイドル判定用)"""
+        self.last_active = time.time()
+    
+    def add_participant(self, participant: Participant) -> int:
+        """
+        参加者追加
+
+        Returns:
+            割り当てたシャード番号
+        """
         self.participants[participant.id] = participant
+        self.touch()
+        if participant.id not in self.shard_index:
+            self.shard_index[participant.id] = self._assign_shard(participant.id)
+        return self.shard_index[participant.id]
     
     def remove_participant(self, participant_id: str):
         """参加者削除"""
         if participant_id in self.participants:
             del self.participants[participant_id]
+            self.touch()
+        index = self.shard_index.pop(participant_id, None)
+        if index is not None:
+            self.shards[index].discard(participant_id)
+    
+    def _assign_shard(self, participant_id: str) -> int:
+        """
+        定員に空きのあるシャードのうち最も空いているものに割り当てる
+
+        退出で空いた番号を再利用するため、シャード数は同時接続数/定員程度に収まる
+        """
+        open_shards = [i for i, members in enumerate(self.shards)
+                       if len(members) < config.ROOM_SHARD_SIZE]
+        if open_shards:
+            index = min(open_shards, key=lambda i: len(self.shards[i]))
+        else:
+            self.shards.append(set())
+            index = len(self.shards) - 1
+        self.shards[index].add(participant_id)
+        return index
+    
+    def shard_name(self, index: int) -> str:
+        """シャードのSocket.IOルーム名"""
+        return f"{self.room_id}#{index}"
+    
+    def shard_of(self, participant_id: str) -> Optional[str]:
+        """参加者が属するシャードのルーム名"""
+        index = self.shard_index.get(participant_id)
+        return None if index is None else self.shard_name(index)
+    
+    def shard_names(self) -> List[str]:
+        """参加者のいるシャードのルーム名一覧"""
+        return [self.shard_name(i) for i, members in enumerate(self.shards) if members]
+    
+    def next_seq(self) -> int:
+        """配信イベントの連番 (ルーム内で単調増加)"""
+        self.seq += 1
+        return self.seq
     
     def set_page(self, page_number: int):
         """ページ設定"""
         self.current_page = page_number
+        self.touch()
     
     def toggle_sync(self, enabled: bool):
         """同期ON/OFF"""
@@ -75,47 +179,279 @@ class Room:
         """注釈全削除"""
         self.annotations = []
     
-    def get_state(self) -> dict:
-        """現在状態取得"""
-        return {
+    def begin_stroke(self, session: StrokeSession) -> bool:
+        """ストローク開始 (同一IDが描画中ならFalse)"""
+        if session.id in self.active_strokes:
+            return False
+        self.active_strokes[session.id] = session
+        return True
+    
+    def append_stroke(self, stroke_id: str, seq: int, points: List[Tuple[float, float]],
+                      owner_sid: Optional[str] = None) -> bool:
+        """
+        ストロークに座標バッチを追加
+        
+        重複・逆順のバッチ (seqが既に処理済み) は破棄してFalseを返す。
+        再接続で欠落したバッチは待たずに先へ進める。
+        owner_sidを渡すと所有者を付け替える (再接続した講師が描画を継続する場合)。
+        所有者が接続中の別の参加者ならFalseを返す。
+        """
+        session = self.active_strokes.get(stroke_id)
+        if not session or seq < session.next_seq or self._owned_by_other(session, owner_sid):
+            return False
+        
+        room_left = config.STROKE_MAX_POINTS - len(session.points)
+        if room_left <= 0:
+            return False
+        
+        session.points.extend(points[:room_left])
+        session.next_seq = seq + 1
+        if owner_sid:
+            session.owner_sid = owner_sid
+        session.updated_at = time.monotonic()
+        return True
+    
+    def end_stroke(self, stroke_id: str, owner_sid: Optional[str] = None) -> Optional[Annotation]:
+        """
+        ストローク終了 - 確定した注釈をルームに追加して返す
+        
+        点が2未満なら注釈にせずNoneを返す。
+        owner_sidを渡すと、接続中の別の参加者が描画中のストロークは終了せずNoneを返す
+        (active_strokesに残る)。
+        """
+        if self._owned_by_other(self.active_strokes.get(stroke_id), owner_sid):
+            return None
+        
+        session = self.active_strokes.pop(stroke_id, None)
+        if not session or len(session.points) < 2:
+            return None
+        
+        annotation = session.to_annotation()
+        self.add_annotation(annotation)
+        return annotation
+    
+    def _owned_by_other(self, session: Optional[StrokeSession], owner_sid: Optional[str]) -> bool:
+        """接続中の別の参加者が描画中のストロークか (切断した所有者のものは引き継げる)"""
+        return bool(session and owner_sid and session.owner_sid != owner_sid and
+                    session.owner_sid in self.participants)
+    
+    def expire_strokes(self, max_idle: float) -> Tuple[List[Annotation], List[str]]:
+        """
+        一定時間更新のないストロークを終了させる (講師の切断時など)
+        
+        Returns:
+            (確定した注釈, 破棄したストロークID)
+        """
+        now = time.monotonic()
+        committed, aborted = [], []
+        for stroke_id, session in list(self.active_strokes.items()):
+            if now - session.updated_at < max_idle:
+                continue
+            annotation = self.end_stroke(stroke_id)
+            if annotation:
+                committed.append(annotation)
+            else:
+                aborted.append(stroke_id)
+        return committed, aborted
+    
+    def get_state(self, binary: bool = True, include_participants: bool = True) -> dict:
+        """
+        現在状態取得
+        
+        include_participants=Falseなら参加者一覧を省き人数のみ返す (受講者向け)
+        """
+        state = {
             "room_id": self.room_id,
             "material_id": self.material_id,
             "current_page": self.current_page,
             "sync_enabled": self.sync_enabled,
-            "participants": [p.to_dict() for p in self.participants.values()],
-            "annotations": [a.to_dict() for a in self.annotations],
+            "participant_count": len(self.participants),
+            "annotations": [a.to_dict(binary) for a in self.annotations],
+            "seq": self.seq,
             "created_at": self.created_at
         }
+        if include_participants:
+            state["participants"] = [p.to_dict() for p in self.participants.values()]
+        return state
+    
+    def instructor_sids(self) -> List[str]:
+        """講師の接続ID一覧"""
+        return [p.id for p in self.participants.values() if p.role == "instructor"]
+    
+    def to_snapshot(self) -> dict:
+        """ディスク退避用のスナップショット (参加者・描画中ストロークは含めない)"""
+        return {
+            "room_id": self.room_id,
+            "material_id": self.material_id,
+            "instructor_id": self.instructor_id,
+            "current_page": self.current_page,
+            "sync_enabled": self.sync_enabled,
+            "annotations": [a.to_dict(binary=False) for a in self.annotations],
+            "created_at": self.created_at,
+            "last_active": self.last_active,
+            "seq": self.seq
+        }
+    
+    @classmethod
+    def from_snapshot(cls, snapshot: dict) -> "Room":
+        """to_snapshotから復元"""
+        room = cls(snapshot["room_id"], snapshot["material_id"], snapshot["instructor_id"])
+        room.current_page = snapshot.get("current_page", 1)
+        room.sync_enabled = snapshot.get("sync_enabled", True)
+        room.created_at = snapshot.get("created_at", room.created_at)
+        room.seq = snapshot.get("seq", 0)
+        room.annotations = [
+            Annotation(**{**a, "data": from_json_safe(a.get("data"))})
+            for a in snapshot.get("annotations", [])
+        ]
+        return room
 
 
 class RoomManager:
     """ルーム管理マネージャー"""
     
-    def __init__(self):
+    def __init__(self, spill_dir: Optional[Path] = None):
+        """
+        Args:
+            spill_dir: アイドルルームの退避先。Noneなら退避せず破棄する
+        """
         self.rooms: Dict[str, Room] = {}
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self._lock = threading.RLock()
+        # 追い出し済みでファイル書き込み待ちのスナップショット (room_id -> snapshot)
+        self._pending_spills: Dict[str, dict] = {}
     
     def create_room(self, room_id: str, material_id: str, instructor_id: str) -> Room:
         """ルーム作成"""
-        if room_id in self.rooms:
-            return self.rooms[room_id]
-        
-        room = Room(room_id, material_id, instructor_id)
-        self.rooms[room_id] = room
-        return room
+        with self._lock:
+            room = self.get_room(room_id)
+            if room:
+                return room
+            
+            room = Room(room_id, material_id, instructor_id)
+            self.rooms[room_id] = room
+            return room
     
     def get_room(self, room_id: str) -> Optional[Room]:
-        """ルーム取得"""
-        return self.rooms.get(room_id)
+        """
+        ルーム取得 (ディスクに退避済みなら復元する)
+        
+        取得したルームはロック内で最終アクティブ時刻を更新する。
+        取得直後に追い出されて、呼び出し側が管理外のオブジェクトを変更するのを防ぐため
+        """
+        with self._lock:
+            room = self.rooms.get(room_id)
+            if not room and room_id in self._pending_spills:
+                room = Room.from_snapshot(self._pending_spills.pop(room_id))
+                self.rooms[room_id] = room
+            if not room and self.spill_dir and room_id:
+                room = self._load_spilled(room_id)
+                if room:
+                    self.rooms[room_id] = room
+            if room:
+                room.touch()
+            return room
     
     def delete_room(self, room_id: str):
         """ルーム削除"""
-        if room_id in self.rooms:
-            del self.rooms[room_id]
+        with self._lock:
+            if room_id in self.rooms:
+                del self.rooms[room_id]
+            self._pending_spills.pop(room_id, None)
+            if self.spill_dir:
+                self._spill_path(room_id).unlink(missing_ok=True)
     
     def get_all_rooms(self) -> List[dict]:
         """全ルーム取得"""
-        return [room.get_state() for room in self.rooms.values()]
+        return [room.get_state(binary=False) for room in list(self.rooms.values())]
+    
+    def reap_idle_rooms(self, idle_ttl: float) -> List[str]:
+        """
+        参加者がおらず一定時間操作のないルームをメモリから追い出す
+        
+        spill_dirが設定されていればディスクに退避し、次のget_roomで復元する。
+        ロック内ではスナップショット取得と削除のみ行い、ファイル書き込みはロック外で行う
+        (書き込み中も他のルームの取得を止めないため)。
+        書き込み前に取得されたルームは書き込み待ちのスナップショットから復元する
+        
+        Returns:
+            追い出したルームID
+        """
+        reaped = []
+        
+        with self._lock:
+            now = time.time()
+            for room_id, room in list(self.rooms.items()):
+                if room.participants or room.active_strokes:
+                    continue
+                if now - room.last_active < idle_ttl:
+                    continue
+                
+                if self.spill_dir:
+                    self._pending_spills[room_id] = room.to_snapshot()
+                del self.rooms[room_id]
+                reaped.append(room_id)
+        
+        if self.spill_dir:
+            for room_id in reaped:
+                self._write_spill(room_id)
+        
+        return reaped
+    
+    def _write_spill(self, room_id: str):
+        """書き込み待ちのスナップショットをファイルに書き出す"""
+        with self._lock:
+            snapshot = self._pending_spills.get(room_id)
+        if snapshot is None:
+            return
+        
+        path = self._spill_path(room_id)
+        write_json_atomic(path, snapshot, indent=None)
+        
+        with self._lock:
+            # 書き込み中に復元・削除されていたら、古いファイルを残さない
+            if self._pending_spills.get(room_id) is snapshot:
+                del self._pending_spills[room_id]
+            else:
+                path.unlink(missing_ok=True)
+    
+    def purge_spilled_rooms(self, retention: float) -> int:
+        """退避から一定期間経ったルームファイルを削除"""
+        if not self.spill_dir or not self.spill_dir.exists():
+            return 0
+        
+        cutoff = time.time() - retention
+        purged = 0
+        for path in self.spill_dir.glob("*.json"):
+            if path.stat().st_mtime < cutoff:
+                path.unlink(missing_ok=True)
+                purged += 1
+        return purged
+    
+    def _spill_path(self, room_id: str) -> Path:
+        """退避ファイルパス (ルームIDはURL由来の任意文字列なのでエスケープする)"""
+        return self.spill_dir / f"{quote(room_id, safe='')}.json"
+    
+    def _load_spilled(self, room_id: str) -> Optional[Room]:
+        """退避ファイルから復元 (復元後はファイルを削除)"""
+        path = self._spill_path(room_id)
+        if not path.exists():
+            return None
+        
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                room = Room.from_snapshot(json.load(f))
+        except (ValueError, KeyError, TypeError) as e:
+            # 壊れたファイルは調査用に退けて、以降の取得で再度読まない
+            corrupt_path = path.with_suffix(".corrupt")
+            path.replace(corrupt_path)
+            log_event("room:spill_corrupt", logging.ERROR, room_id=room_id,
+                      path=str(corrupt_path), error=str(e))
+            return None
+        path.unlink(missing_ok=True)
+        room.touch()
+        return room
 
 
 # グローバルインスタンス
-room_manager = RoomManager()
+room_manager = RoomManager(config.ROOM_SPILL_DIR if config.ROOM_SPILL_ENABLED else None)
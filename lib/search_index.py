@@ -0,0 +1,212 @@
+"""
+全文検索モジュール - 文字N-gramによる教材ページの転置インデックス
+"""
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import json
+import math
+import re
+import threading
+import unicodedata
+import config
+from lib.atomic_io import write_json_atomic
+
+
+INDEX_VERSION = 2
+
+# 単語文字の連続 (日本語は分かち書きしないので文字N-gramに分解する)
+_WORD_RUN = re.compile(r"\w+")
+
+
+def normalize_text(text: str) -> str:
+    """全角英数の半角化・小文字化・空白の圧縮"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def tokenize(text: str, n: int = 2, word_final: bool = False) -> List[str]:
+    """
+    文字N-gramに分解
+
+    単語文字の連続ごとにN-gramを取り、N文字未満の連続はそのまま1トークンとする
+
+    Args:
+        word_final: Trueなら連続の末尾N-1文字も1トークンとして加える (索引作成用)。
+            N文字未満のクエリはN-gramの前方一致で探すため、語末の文字はこれで拾う
+    """
+    tokens = []
+    for run in _WORD_RUN.findall(normalize_text(text)):
+        if len(run) < n:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + n] for i in range(len(run) - n + 1))
+            if word_final:
+                tokens.append(run[len(run) - n + 1:])
+    return tokens
+
+
+class SearchIndex:
+    """教材ページの転置インデックス (search_index.jsonに永続化)"""
+
+    def __init__(self, index_path: Path, ngram: int = 2):
+        self.index_path = Path(index_path)
+        self.ngram = ngram
+        self.docs: Dict[str, dict] = {}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self._mtime: Optional[float] = None
+        self._lock = threading.RLock()
+
+    def add_material(self, material_id: str, title: str, pages: List[Tuple[int, str]]):
+        """
+        教材を登録 (登録済みなら置き換え)
+
+        Args:
+            material_id: 教材ID
+            title: 教材タイトル
+            pages: [(ページ番号, ページ本文), ...]
+        """
+        with self._lock:
+            self._reload_if_changed()
+            self._remove_docs(material_id)
+
+            for page_number, text in pages:
+                doc_key = f"{material_id}:{page_number}"
+                grams = Counter(tokenize(f"{title} {text}", self.ngram, word_final=True))
+                if not grams:
+                    continue
+
+                self.docs[doc_key] = {
+                    "material_id": material_id,
+                    "title": title,
+                    "page_number": page_number,
+                    "length": sum(grams.values()),
+                    "text": normalize_text(text)
+                }
+                for gram, tf in grams.items():
+                    self.postings.setdefault(gram, {})[doc_key] = tf
+
+    def remove_material(self, material_id: str):
+        """教材を削除"""
+        with self._lock:
+            self._reload_if_changed()
+            self._remove_docs(material_id)
+
+    def search(self, query: str, limit: int = 20) -> List[dict]:
+        """
+        全N-gramを含むページをTF-IDFでランク付けして返す
+
+        Returns:
+            [{"material_id", "title", "page_number", "score", "snippet"}, ...]
+        """
+        with self._lock:
+            self._reload_if_changed()
+
+            grams = set(tokenize(query, self.ngram))
+            if not grams or not self.docs:
+                return []
+
+            total_docs = len(self.docs)
+            scores: Optional[Dict[str, float]] = None
+
+            # 出現ページの少ないN-gramから絞り込む
+            candidates = sorted((self._postings_for(g) for g in grams), key=len)
+            for postings in candidates:
+                if not postings:
+                    return []
+
+                idf = math.log(1 + total_docs / len(postings))
+                if scores is None:
+                    scores = {doc: tf * idf for doc, tf in postings.items()}
+                else:
+                    scores = {doc: score + postings[doc] * idf
+                              for doc, score in scores.items() if doc in postings}
+                if not scores:
+                    return []
+
+            ranked = sorted(
+                scores.items(),
+                key=lambda item: item[1] / math.sqrt(self.docs[item[0]]["length"]),
+                reverse=True
+            )[:limit]
+
+            normalized_query = normalize_text(query)
+            return [
+                {
+                    "material_id": self.docs[doc]["material_id"],
+                    "title": self.docs[doc]["title"],
+                    "page_number": self.docs[doc]["page_number"],
+                    "score": round(score / math.sqrt(self.docs[doc]["length"]), 4),
+                    "snippet": self._snippet(self.docs[doc]["text"], normalized_query)
+                }
+                for doc, score in ranked
+            ]
+
+    def save(self):
+        """インデックスをファイルに保存"""
+        with self._lock:
+            write_json_atomic(self.index_path, {
+                "version": INDEX_VERSION,
+                "ngram": self.ngram,
+                "docs": self.docs,
+                "postings": self.postings
+            }, indent=None)
+            self._mtime = self.index_path.stat().st_mtime
+
+    def _postings_for(self, gram: str) -> Dict[str, int]:
+        """N-gramの出現ページ (N文字未満のクエリは前方一致で集める)"""
+        if len(gram) >= self.ngram:
+            return self.postings.get(gram, {})
+
+        merged: Dict[str, int] = {}
+        for key, postings in self.postings.items():
+            if key.startswith(gram):
+                for doc, tf in postings.items():
+                    merged[doc] = merged.get(doc, 0) + tf
+        return merged
+
+    def _remove_docs(self, material_id: str):
+        """教材のページをインデックスから除く"""
+        doc_keys = {k for k, d in self.docs.items() if d["material_id"] == material_id}
+        if not doc_keys:
+            return
+
+        for key in doc_keys:
+            del self.docs[key]
+        for gram in list(self.postings):
+            postings = self.postings[gram]
+            for key in doc_keys & postings.keys():
+                del postings[key]
+            if not postings:
+                del self.postings[gram]
+
+    def _reload_if_changed(self):
+        """別プロセス (変換スクリプト) による更新を取り込む"""
+        try:
+            mtime = self.index_path.stat().st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        if data.get("version") == INDEX_VERSION and data.get("ngram") == self.ngram:
+            self.docs = data["docs"]
+            self.postings = data["postings"]
+        self._mtime = mtime
+
+    @staticmethod
+    def _snippet(text: str, query: str, width: int = 40) -> str:
+        """クエリ周辺の本文抜粋"""
+        pos = text.find(query)
+        if pos < 0:
+            return text[:width * 2]
+        start = max(0, pos - width)
+        end = min(len(text), pos + len(query) + width)
+        return ("…" if start > 0 else "") + text[start:end] + ("…" if end < len(text) else "")
+
+
+# グローバルインスタンス
+search_index = SearchIndex(config.SEARCH_INDEX_PATH)
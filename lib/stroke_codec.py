@@ -0,0 +1,174 @@
+"""
+ペンストローク圧縮モジュール - 座標の量子化・バイナリ化・間引き
+"""
+import base64
+import math
+import struct
+from typing import Iterable, List, Sequence, Tuple
+import config
+
+
+Point = Tuple[float, float]
+
+# 座標はパーセント (0-100) で扱う
+COORD_MIN = 0.0
+COORD_MAX = 100.0
+
+
+def normalize_points(points: Iterable) -> List[Point]:
+    """
+    クライアントから届いた座標列を (x, y) タプルのリストに揃える
+
+    {"x": .., "y": ..} 形式と [x, y] 形式の両方を受け付ける。
+    形式が崩れた点や数値でない・有限でない (NaN/inf) 座標は捨てる
+    """
+    if not isinstance(points, (list, tuple)):
+        return []
+
+    normalized = []
+    for p in points:
+        if isinstance(p, dict):
+            x, y = p.get("x"), p.get("y")
+        elif isinstance(p, (list, tuple)) and len(p) >= 2:
+            x, y = p[0], p[1]
+        else:
+            continue
+        if not (_is_number(x) and _is_number(y)):
+            continue
+        normalized.append((float(x), float(y)))
+    return normalized
+
+
+def _is_number(value) -> bool:
+    """有限の数値か (boolは除く)"""
+    return (isinstance(value, (int, float)) and not isinstance(value, bool)
+            and math.isfinite(value))
+
+
+def simplify_points(points: Sequence[Point], tolerance: float) -> List[Point]:
+    """
+    Ramer–Douglas–Peucker法で座標列を間引く
+
+    Args:
+        points: 座標列
+        tolerance: 許容誤差 (パーセント座標単位)。0以下なら間引かない
+    """
+    if tolerance <= 0 or len(points) < 3:
+        return list(points)
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    tolerance_sq = tolerance * tolerance
+
+    # 再帰の代わりに区間スタックで処理 (長いストロークでも深さ制限に当たらない)
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        x1, y1 = points[start]
+        x2, y2 = points[end]
+        dx, dy = x2 - x1, y2 - y1
+        length_sq = dx * dx + dy * dy
+
+        max_dist_sq = -1.0
+        index = start
+        for i in range(start + 1, end):
+            px, py = points[i]
+            if length_sq == 0:
+                dist_sq = (px - x1) ** 2 + (py - y1) ** 2
+            else:
+                cross = dx * (py - y1) - dy * (px - x1)
+                dist_sq = cross * cross / length_sq
+            if dist_sq > max_dist_sq:
+                max_dist_sq = dist_sq
+                index = i
+
+        if max_dist_sq > tolerance_sq:
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+    return [p for p, k in zip(points, keep) if k]
+
+
+def pack_points(points: Sequence[Point], scale: int = None) -> bytes:
+    """
+    座標列を量子化し、リトルエンディアンのuint16 (x, y交互) に詰める
+    """
+    scale = scale or config.PEN_QUANT_SCALE
+    flat = []
+    for x, y in points:
+        x = min(max(x, COORD_MIN), COORD_MAX)
+        y = min(max(y, COORD_MIN), COORD_MAX)
+        flat.append(int(round(x * scale)))
+        flat.append(int(round(y * scale)))
+    return struct.pack(f"<{len(flat)}H", *flat)
+
+
+def unpack_points(packed: bytes, scale: int = None) -> List[Point]:
+    """pack_pointsの逆変換"""
+    scale = scale or config.PEN_QUANT_SCALE
+    count = len(packed) // 2
+    flat = struct.unpack(f"<{count}H", packed[:count * 2])
+    return [(flat[i] / scale, flat[i + 1] / scale) for i in range(0, count - 1, 2)]
+
+
+def encode_points(points: Iterable, tolerance: float = None) -> Tuple[bytes, int]:
+    """
+    座標列を間引き・量子化してバイナリ化
+
+    Returns:
+        (packed, point_count)
+    """
+    if tolerance is None:
+        tolerance = config.PEN_SIMPLIFY_TOLERANCE
+    simplified = simplify_points(normalize_points(points), tolerance)
+    return pack_points(simplified), len(simplified)
+
+
+def encode_pen_data(data: dict, tolerance: float = None) -> dict:
+    """
+    ペン注釈のdataをコンパクト形式に変換
+
+    `points` (座標配列) を `packed` (bytes) に置き換える。
+    既に `packed` を持つ場合は量子化済みとみなし、間引きのみ適用する。
+    """
+    data = dict(data or {})
+    scale = config.PEN_QUANT_SCALE
+
+    if "points" in data:
+        points = data.pop("points")
+    elif isinstance(data.get("packed"), (bytes, bytearray)):
+        points = unpack_points(bytes(data["packed"]), data.get("scale", scale))
+    else:
+        return data
+
+    packed, point_count = encode_points(points, tolerance)
+    data["packed"] = packed
+    data["point_count"] = point_count
+    data["scale"] = scale
+    return data
+
+
+def to_json_safe(data: dict) -> dict:
+    """bytes値をbase64文字列に置き換えたコピーを返す (HTTP API・ファイル保存用)"""
+    if not data:
+        return data
+    safe = {}
+    for key, value in data.items():
+        if isinstance(value, (bytes, bytearray)):
+            safe[key] = base64.b64encode(bytes(value)).decode("ascii")
+        else:
+            safe[key] = value
+    return safe
+
+
+def from_json_safe(data: dict) -> dict:
+    """to_json_safeの逆変換 (packedのbase64文字列をbytesに戻す)"""
+    if not data or not isinstance(data.get("packed"), str):
+        return data
+    restored = dict(data)
+    restored["packed"] = base64.b64decode(restored["packed"])
+    return restored
@@ -7,8 +7,19 @@ from pathlib import Path
 # プロジェクトルートをパスに追加
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+import json
 import config
-from lib.pdf_processor import PDFProcessor, generate_manifest
+from lib.asset_store import asset_store
+from lib.atomic_io import write_json_atomic
+from lib.deck_bundle import build_bundle, build_precache
+from lib.pdf_processor import (
+    PDFProcessor, generate_manifest, check_manifest, build_thumbnail_atlas, build_placeholders,
+    material_id_from_filename, extract_pages_text
+)
+from lib.search_index import search_index
+
+# ユーザーがアップロードした教材PDFの置き場所
+USER_UPLOADS_DIR = Path("/home/user/uploaded_files")
 
 
 def convert_pdf(pdf_path: str) -> dict:
@@ -27,7 +38,7 @@ def convert_pdf(pdf_path: str) -> dict:
         raise FileNotFoundError(f"PDFが見つかりません: {pdf_path}")
     
     # 教材ID生成 (ファイル名から)
-    material_id = pdf_file.stem.replace(" ", "_").replace("(", "").replace(")", "")
+    material_id = material_id_from_filename(pdf_file.name)
     
     # 変換実行
     processor = PDFProcessor(pdf_path, material_id)
@@ -61,9 +72,9 @@ def convert_all_uploaded_pdfs():
             print(f"エラー: {pdf_file.name} - {e}\n")
             continue
     
-    # manifest.json生成
-    print("=== Manifest生成 ===")
-    generate_manifest(config.MATERIALS_DIR)
+    # manifest.jsonは変換ごとに差分更新済み。手動変更分のみ整合性確認で拾う
+    print("=== Manifest整合性確認 ===")
+    print_manifest_changes(check_manifest(config.MATERIALS_DIR))
     
     print("\n=== 変換完了 ===")
 
@@ -73,7 +84,7 @@ def convert_user_uploaded_files():
     /home/user/uploaded_files/ 内のPDFを変換
     (ユーザーがアップロードした教材PDFの初回変換用)
     """
-    source_dir = Path("/home/user/uploaded_files")
+    source_dir = USER_UPLOADS_DIR
     
     if not source_dir.exists():
         print("uploaded_filesディレクトリが見つかりません")
@@ -96,14 +107,174 @@ def convert_user_uploaded_files():
             print(f"エラー: {pdf_file.name} - {e}\n")
             continue
     
-    # manifest.json生成
-    print("=== Manifest生成 ===")
-    generate_manifest(config.MATERIALS_DIR)
+    # manifest.jsonは変換ごとに差分更新済み。手動変更分のみ整合性確認で拾う
+    print("=== Manifest整合性確認 ===")
+    print_manifest_changes(check_manifest(config.MATERIALS_DIR))
     
     print("\n=== 変換完了 ===")
     print(f"教材ディレクトリ: {config.MATERIALS_DIR}")
 
 
+def print_manifest_changes(changes: dict):
+    """check_manifestの結果表示"""
+    labels = {"added": "追加", "updated": "更新", "removed": "削除"}
+    if not any(changes.values()):
+        print("✓ Manifestは最新です")
+        return
+    for key, label in labels.items():
+        for material_id in changes[key]:
+            print(f"✓ {label}: {material_id}")
+
+
+def build_all_thumbnail_atlases():
+    """変換済み教材のサムネイルスプライトを (再)生成"""
+    print("=== サムネイルスプライト生成 ===\n")
+    
+    for metadata_path in sorted(config.MATERIALS_DIR.glob("*/metadata.json")):
+        material_dir = metadata_path.parent
+        try:
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+            
+            metadata["thumbnail_atlas"] = build_thumbnail_atlas(material_dir, metadata)
+            
+            write_json_atomic(metadata_path, metadata)
+            
+            print(f"✓ {material_dir.name} ({len(metadata['thumbnail_atlas'].get('tiles', []))}枚)")
+        except Exception as e:
+            print(f"エラー: {material_dir.name} - {e}")
+            continue
+
+
+def build_all_placeholders():
+    """変換済み教材の低画質プレースホルダーを (再)生成"""
+    print("=== プレースホルダー生成 ===\n")
+    
+    for metadata_path in sorted(config.MATERIALS_DIR.glob("*/metadata.json")):
+        material_dir = metadata_path.parent
+        try:
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+            
+            count = build_placeholders(metadata)
+            write_json_atomic(metadata_path, metadata)
+            
+            print(f"✓ {material_dir.name} ({count}ページ)")
+        except Exception as e:
+            print(f"エラー: {material_dir.name} - {e}")
+            continue
+
+
+def build_all_bundles():
+    """変換済み教材の一括ダウンロード用バンドルを (再)生成"""
+    print("=== バンドル生成 ===\n")
+    
+    for metadata_path in sorted(config.MATERIALS_DIR.glob("*/metadata.json")):
+        material_dir = metadata_path.parent
+        try:
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+            
+            precache = build_precache(material_dir, metadata)
+            bundle_path = build_bundle(material_dir, metadata)
+            
+            print(f"✓ {material_dir.name} ({len(precache['assets'])}ファイル, {bundle_path.stat().st_size // 1024}KB)")
+        except Exception as e:
+            print(f"エラー: {material_dir.name} - {e}")
+            continue
+
+
+def reindex_all_materials():
+    """
+    変換済み教材の全文検索インデックスを元PDFから作り直す
+
+    本文はメタデータに残していないため、uploads/と/home/user/uploaded_files/から
+    教材IDが一致するPDFを探して読む (画像は再生成しない)
+    """
+    print("=== 全文検索インデックス再構築 ===\n")
+    
+    sources = {}
+    for source_dir in (USER_UPLOADS_DIR, config.UPLOADS_DIR):
+        if source_dir.exists():
+            for pdf_file in source_dir.glob("*.pdf"):
+                sources[material_id_from_filename(pdf_file.name)] = pdf_file
+    
+    for metadata_path in sorted(config.MATERIALS_DIR.glob("*/metadata.json")):
+        material_dir = metadata_path.parent
+        try:
+            pdf_file = sources.get(material_dir.name)
+            if not pdf_file:
+                print(f"スキップ: {material_dir.name} (元PDFが見つかりません)")
+                continue
+            
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+            
+            pages_text = extract_pages_text(pdf_file)
+            search_index.add_material(material_dir.name, metadata["title"], pages_text)
+            
+            print(f"✓ {material_dir.name} ({len(pages_text)}ページ)")
+        except Exception as e:
+            print(f"エラー: {material_dir.name} - {e}")
+            continue
+    
+    search_index.save()
+
+
+def import_assets_to_store():
+    """変換済み教材のページ画像・サムネイルをアセットストアへ移し、重複を除く"""
+    print("=== アセットストアへ取り込み ===\n")
+    
+    for metadata_path in sorted(config.MATERIALS_DIR.glob("*/metadata.json")):
+        material_dir = metadata_path.parent
+        try:
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+            
+            originals = []
+            for page in metadata["pages"]:
+                for url_key, hash_key in (("image_url", "image_hash"), ("thumbnail_url", "thumbnail_hash")):
+                    if asset_store.path_for_url(page[url_key]):
+                        continue
+                    source = config.STATIC_DIR / page[url_key].removeprefix("/static/")
+                    page[hash_key], page[url_key] = asset_store.put_file(source)
+                    originals.append(source)
+            
+            atlas = metadata.get("thumbnail_atlas")
+            if atlas and not asset_store.path_for_url(atlas["url"]):
+                source = config.STATIC_DIR / atlas["url"].removeprefix("/static/")
+                atlas["hash"], atlas["url"] = asset_store.put_file(source)
+                originals.append(source)
+            
+            write_json_atomic(metadata_path, metadata)
+            
+            # メタデータが新しいURLを指してから元ファイルを消す
+            for source in originals:
+                source.unlink(missing_ok=True)
+            
+            print(f"✓ {material_dir.name} ({len(originals)}ファイル)")
+        except Exception as e:
+            print(f"エラー: {material_dir.name} - {e}")
+            continue
+
+
+def prune_asset_store():
+    """どの教材からも参照されていないアセットを削除 (変換中は実行しないこと)"""
+    referenced = set()
+    
+    for metadata_path in config.MATERIALS_DIR.glob("*/metadata.json"):
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        for page in metadata["pages"]:
+            referenced.update(filter(None, (page.get("image_hash"), page.get("thumbnail_hash"))))
+        atlas = metadata.get("thumbnail_atlas") or {}
+        if atlas.get("hash"):
+            referenced.add(atlas["hash"])
+    
+    removed = asset_store.prune(referenced)
+    print(f"✓ 未参照アセット削除: {removed}ファイル")
+
+
 if __name__ == "__main__":
     import argparse
     
@@ -111,18 +282,45 @@ if __name__ == "__main__":
     parser.add_argument("--file", "-f", help="変換するPDFファイルパス")
     parser.add_argument("--all", "-a", action="store_true", help="uploads/内の全PDF変換")
     parser.add_argument("--user-uploads", "-u", action="store_true", help="/home/user/uploaded_files/内の全PDF変換")
+    parser.add_argument("--atlas", action="store_true", help="変換済み教材のサムネイルスプライト生成")
+    parser.add_argument("--placeholders", action="store_true", help="変換済み教材の低画質プレースホルダー生成")
+    parser.add_argument("--bundles", action="store_true", help="変換済み教材の一括ダウンロード用バンドル生成")
+    parser.add_argument("--reindex", action="store_true", help="変換済み教材の全文検索インデックスを再構築")
+    parser.add_argument("--rebuild-manifest", action="store_true", help="manifest.jsonを全教材から再構築")
+    parser.add_argument("--import-assets", action="store_true", help="変換済み教材の画像をアセットストアへ移行")
+    parser.add_argument("--prune-assets", action="store_true", help="未参照アセットを削除 (変換中は実行しない)")
     
     args = parser.parse_args()
     
     if args.file:
         convert_pdf(args.file)
-        generate_manifest(config.MATERIALS_DIR)
     elif args.user_uploads:
         convert_user_uploaded_files()
     elif args.all:
         convert_all_uploaded_pdfs()
+    elif args.atlas:
+        build_all_thumbnail_atlases()
+    elif args.placeholders:
+        build_all_placeholders()
+    elif args.bundles:
+        build_all_bundles()
+    elif args.reindex:
+        reindex_all_materials()
+    elif args.rebuild_manifest:
+        generate_manifest(config.MATERIALS_DIR)
+    elif args.import_assets:
+        import_assets_to_store()
+    elif args.prune_assets:
+        prune_asset_store()
     else:
         print("使用方法:")
         print("  単一ファイル: python convert_pdfs.py -f path/to/file.pdf")
         print("  全ファイル: python convert_pdfs.py -a")
         print("  ユーザーアップロード: python convert_pdfs.py -u")
+        print("  サムネイルスプライト: python convert_pdfs.py --atlas")
+        print("  プレースホルダー: python convert_pdfs.py --placeholders")
+        print("  バンドル: python convert_pdfs.py --bundles")
+        print("  検索インデックス再構築: python convert_pdfs.py --reindex")
+        print("  Manifest再構築: python convert_pdfs.py --rebuild-manifest")
+        print("  アセットストア移行: python convert_pdfs.py --import-assets")
+        print("  未参照アセット削除: python convert_pdfs.py --prune-assets")
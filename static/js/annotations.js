@@ -27,6 +27,8 @@ class AnnotationLayer {
     }
     
     addAnnotation(annotation) {
+        // 同じIDの注釈は置き換える (途中参加時の状態と配信が重なる場合)
+        this.annotations = this.annotations.filter(a => a.id !== annotation.id);
         this.annotations.push(annotation);
         this.render();
         console.log('注釈を追加しました:', annotation.type, annotation);
@@ -71,7 +73,7 @@ class AnnotationLayer {
                 this.renderRect(data.x, data.y, data.width || 100, data.height || 100, data.color || 'red');
                 break;
             case 'pen':
-                this.renderPen(data.points, data.color || 'red');
+                this.renderPen(decodePenPoints(data), data.color || 'red');
                 break;
         }
     }
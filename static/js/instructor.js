@@ -7,6 +7,8 @@ class InstructorController {
         this.syncEnabled = true;
         this.annotationMode = null;
         this.annotations = [];
+        this.participants = new Map();
+        this.stroke = null;  // 描画中のペンストローク
     }
     
     async init(roomId) {
@@ -15,7 +17,7 @@ class InstructorController {
         // ページ変更を同期送信
         document.addEventListener('pagechange', (e) => {
             sync.sendPageChange(e.detail.pageNumber);
-            this.updateInstructorNotes();
+            viewer.loadPageDetail(e.detail.pageNumber).then(() => this.updateInstructorNotes());
         });
         
         // 注釈モードセットアップ
@@ -59,9 +61,7 @@ class InstructorController {
                 return;
             }
             
-            const rect = pageContainer.getBoundingClientRect();
-            const x = ((e.clientX - rect.left) / rect.width) * 100;
-            const y = ((e.clientY - rect.top) / rect.height) * 100;
+            const {x, y} = this.toPagePoint(e, pageContainer);
             
             console.log(`クリック位置: (${x.toFixed(2)}%, ${y.toFixed(2)}%), モード: ${this.annotationMode}`);
             
@@ -76,9 +76,62 @@ class InstructorController {
             }
         });
         
+        // ペン: 押している間の座標を一定間隔でまとめて送る（確定はstroke:endでサーバー側）
+        pageContainer.addEventListener('pointerdown', (e) => {
+            if (this.annotationMode !== 'pen') return;
+            e.preventDefault();
+            pageContainer.setPointerCapture(e.pointerId);
+            this.beginStroke(this.toPagePoint(e, pageContainer));
+        });
+        
+        pageContainer.addEventListener('pointermove', (e) => {
+            if (!this.stroke) return;
+            const point = this.toPagePoint(e, pageContainer);
+            this.stroke.points.push(point);
+            this.stroke.pending.push(point);
+            sync.drawPenPath(this.stroke.id, this.stroke.points, this.stroke.color);
+        });
+        
+        pageContainer.addEventListener('pointerup', () => this.endStroke());
+        pageContainer.addEventListener('pointercancel', () => this.endStroke());
+        
         console.log('注釈モードのクリックイベントを設定しました');
     }
     
+    toPagePoint(e, pageContainer) {
+        const rect = pageContainer.getBoundingClientRect();
+        return {
+            x: ((e.clientX - rect.left) / rect.width) * 100,
+            y: ((e.clientY - rect.top) / rect.height) * 100
+        };
+    }
+    
+    beginStroke(point) {
+        const color = 'red';
+        this.stroke = {
+            id: this.generateId(),
+            color: color,
+            points: [point],
+            pending: [point],
+            timer: setInterval(() => this.flushStroke(), 50)
+        };
+        sync.sendStrokeBegin(this.stroke.id, viewer.currentPage, {color});
+    }
+    
+    flushStroke() {
+        if (!this.stroke || this.stroke.pending.length === 0) return;
+        sync.sendStrokePoints(this.stroke.id, this.stroke.pending);
+        this.stroke.pending = [];
+    }
+    
+    endStroke() {
+        if (!this.stroke) return;
+        clearInterval(this.stroke.timer);
+        this.flushStroke();
+        sync.sendStrokeEnd(this.stroke.id);
+        this.stroke = null;
+    }
+    
     addPin(x, y) {
         const annotation = {
             id: this.generateId(),
@@ -205,6 +258,37 @@ class InstructorController {
         document.getElementById('important-modal').classList.remove('show');
     }
     
+    setParticipants(participants) {
+        this.participants = new Map((participants || []).map(p => [p.id, p]));
+        this.renderParticipants();
+    }
+    
+    applyPresenceDelta(delta) {
+        delta.left.forEach(id => this.participants.delete(id));
+        delta.joined.forEach(p => this.participants.set(p.id, p));
+        this.renderParticipants();
+    }
+    
+    renderParticipants() {
+        document.getElementById('participant-count').textContent = this.participants.size;
+        // 名前は受講者が自由に入力するのでtextContentで入れる
+        const list = document.getElementById('participants-list');
+        list.replaceChildren(...Array.from(this.participants.values()).map(p => {
+            const row = document.createElement('div');
+            row.className = 'flex justify-between';
+            
+            const name = document.createElement('span');
+            name.textContent = p.name;
+            
+            const role = document.createElement('span');
+            role.className = 'text-gray-500';
+            role.textContent = p.role === 'instructor' ? '講師' : '受講者';
+            
+            row.append(name, role);
+            return row;
+        }));
+    }
+    
     updateInstructorNotes() {
         const currentPage = viewer.getCurrentPage();
         const notesContent = document.getElementById('instructor-notes-content');
@@ -9,6 +9,16 @@ class SyncManager {
         this.connected = false;
         this.syncEnabled = true;
         this.callbacks = {};
+        this.liveStrokes = {};  // 描画中ストローク (stroke_id -> 座標配列)
+        this.strokeSeq = {};    // 送信中ストロークの連番
+        this.stateSeq = 0;      // room:stateに反映済みの配信連番 (これ以下の配信は無視する)
+        
+        // 同期遅延テレメトリ (設定はroom:stateで受け取る)
+        this.telemetry = {sampleRate: 0, batchSize: 20, flushInterval: 10};
+        this.clockOffset = 0;   // サーバー時刻 - クライアント時刻 (ms)
+        this.latencySamples = [];
+        this.latencyTimer = null;
+        this.clockTimer = null;
     }
     
     async init(roomId, role, callbacks = {}) {
@@ -76,11 +86,20 @@ class SyncManager {
         this.socket.on('room:state', async (state) => {
             console.log('ルーム状態受信:', state);
             
+            // 配信はシャードごとのキュー経由なので、状態に含まれる分が後から届くことがある
+            this.stateSeq = state.seq || 0;
+            
             // 教材読み込み
             await viewer.loadMaterial(state.material_id);
             
             // 現在ページへ
             viewer.goToPage(state.current_page);
+            viewer.prefetch(state.prefetch);
+            
+            // 遅延テレメトリ設定
+            if (state.telemetry) {
+                this.startTelemetry(state.telemetry);
+            }
             
             // 同期状態
             this.syncEnabled = state.sync_enabled;
@@ -96,11 +115,15 @@ class SyncManager {
         
         // ページ変更
         this.socket.on('page:changed', (data) => {
+            if (data.seq <= this.stateSeq) return;
             console.log('ページ変更:', data.page_number);
             
+            const receivedAt = this.serverNow();
             if (this.syncEnabled && this.role === 'student') {
-                viewer.goToPage(data.page_number);
+                viewer.goToPage(data.page_number, data.placeholder);
             }
+            this.sampleLatency('page:changed', data, receivedAt);
+            viewer.prefetch(data.prefetch);
             
             if (this.callbacks.onPageChange) {
                 this.callbacks.onPageChange(data.page_number);
@@ -120,13 +143,38 @@ class SyncManager {
         
         // 注釈追加
         this.socket.on('annotation:added', (annotation) => {
+            if (annotation.seq <= this.stateSeq) return;
+            const receivedAt = this.serverNow();
             this.addAnnotation(annotation);
+            this.sampleLatency('annotation:added', annotation, receivedAt);
             
             if (this.callbacks.onAnnotationAdded) {
                 this.callbacks.onAnnotationAdded(annotation);
             }
         });
         
+        // ペンストローク (描画中のリアルタイム表示)
+        this.socket.on('stroke:started', (data) => {
+            this.liveStrokes[data.stroke_id] = {
+                pageNumber: data.page_number,
+                color: (data.data && data.data.color) || 'red',
+                points: []
+            };
+        });
+        
+        this.socket.on('stroke:points', (data) => {
+            const stroke = this.liveStrokes[data.stroke_id];
+            if (!stroke) return;
+            
+            stroke.points.push(...decodePenPoints(data));
+            this.drawPenPath(data.stroke_id, stroke.points, stroke.color);
+        });
+        
+        this.socket.on('stroke:aborted', (data) => {
+            delete this.liveStrokes[data.stroke_id];
+            this.removeAnnotation(data.stroke_id);
+        });
+        
         // 注釈削除
         this.socket.on('annotation:removed', (data) => {
             this.removeAnnotation(data.id);
@@ -145,21 +193,27 @@ class SyncManager {
             }
         });
         
-        // 参加者追加
-        this.socket.on('participant:joined', (participant) => {
-            console.log('参加者追加:', participant);
+        // 参加者の入退室差分（講師のみ、一定間隔でまとめて届く）
+        this.socket.on('presence:delta', (delta) => {
+            console.log('参加者差分:', delta);
             
-            if (this.callbacks.onParticipantJoined) {
-                this.callbacks.onParticipantJoined(participant);
+            if (this.callbacks.onPresenceDelta) {
+                this.callbacks.onPresenceDelta(delta);
             }
         });
         
-        // 参加者退出
-        this.socket.on('participant:left', (data) => {
-            console.log('参加者退出:', data.id);
-            
-            if (this.callbacks.onParticipantLeft) {
-                this.callbacks.onParticipantLeft(data.id);
+        // 回線が追いつかない間はサーバーが描画中ストロークの配信を止める
+        this.socket.on('sync:downgraded', (data) => {
+            console.warn(data.live ? 'ライブ描画の配信を再開' : '送信遅延のためライブ描画の配信を停止');
+            if (!data.live) {
+                this.liveStrokes = {};
+            }
+        });
+        
+        // 参加人数（全員）
+        this.socket.on('presence:count', (data) => {
+            if (this.callbacks.onParticipantCount) {
+                this.callbacks.onParticipantCount(data.count);
             }
         });
         
@@ -174,6 +228,63 @@ class SyncManager {
         });
     }
     
+    // 遅延テレメトリ開始（設定はroom:stateで受け取る）
+    startTelemetry(settings) {
+        this.telemetry = {
+            sampleRate: settings.sample_rate,
+            batchSize: settings.batch_size,
+            flushInterval: settings.flush_interval
+        };
+        
+        // 時計合わせは接続直後と1分ごと
+        clearInterval(this.clockTimer);
+        clearInterval(this.latencyTimer);
+        this.syncClock();
+        this.clockTimer = setInterval(() => this.syncClock(), 60000);
+        this.latencyTimer = setInterval(() => this.flushLatencySamples(), this.telemetry.flushInterval * 1000);
+    }
+    
+    syncClock() {
+        // 往復時間の中点をサーバー時刻とみなしてずれを求める
+        const sentAt = Date.now();
+        this.socket.emit('latency:ping', {client_ts: sentAt}, (res) => {
+            if (!res || res.client_ts !== sentAt) return;
+            this.clockOffset = res.server_ts - (sentAt + Date.now()) / 2;
+        });
+    }
+    
+    serverNow() {
+        return Date.now() + this.clockOffset;
+    }
+    
+    sampleLatency(event, data, receivedAt) {
+        // 一部のイベントだけ受信時刻と次の描画フレームの時刻を記録する
+        if (!data.server_ts || Math.random() >= this.telemetry.sampleRate) return;
+        
+        requestAnimationFrame(() => {
+            this.latencySamples.push({
+                event: event,
+                seq: data.seq,
+                server_ts: data.server_ts,
+                received_at: receivedAt,
+                rendered_at: this.serverNow()
+            });
+            if (this.latencySamples.length >= this.telemetry.batchSize) {
+                this.flushLatencySamples();
+            }
+        });
+    }
+    
+    flushLatencySamples() {
+        if (this.latencySamples.length === 0 || !this.connected) return;
+        
+        this.socket.emit('latency:report', {
+            room_id: this.roomId,
+            samples: this.latencySamples
+        });
+        this.latencySamples = [];
+    }
+    
     // ページ変更送信（講師のみ）
     sendPageChange(pageNumber) {
         if (this.role !== 'instructor') return;
@@ -204,6 +315,40 @@ class SyncManager {
         });
     }
     
+    // ペンストローク送信（講師のみ）- begin → append (複数回) → end
+    sendStrokeBegin(strokeId, pageNumber, data) {
+        if (this.role !== 'instructor') return;
+        
+        this.strokeSeq[strokeId] = 0;
+        this.socket.emit('stroke:begin', {
+            room_id: this.roomId,
+            stroke_id: strokeId,
+            page_number: pageNumber,
+            data: data
+        });
+    }
+    
+    sendStrokePoints(strokeId, points) {
+        if (this.role !== 'instructor' || !(strokeId in this.strokeSeq)) return;
+        
+        this.socket.emit('stroke:append', {
+            room_id: this.roomId,
+            stroke_id: strokeId,
+            seq: this.strokeSeq[strokeId]++,
+            points: points.map(p => [p.x, p.y])
+        });
+    }
+    
+    sendStrokeEnd(strokeId) {
+        if (this.role !== 'instructor') return;
+        
+        delete this.strokeSeq[strokeId];
+        this.socket.emit('stroke:end', {
+            room_id: this.roomId,
+            stroke_id: strokeId
+        });
+    }
+    
     // 注釈削除送信（講師のみ）
     sendAnnotationRemove(annotationId) {
         if (this.role !== 'instructor') return;
@@ -257,6 +402,7 @@ class SyncManager {
         const layer = document.getElementById('annotation-layer');
         
         if (annotation.type === 'pin') {
+            this.removeAnnotation(annotation.id);
             const pin = document.createElementNS('http://www.w3.org/2000/svg', 'circle');
             pin.setAttribute('cx', `${annotation.data.x}%`);
             pin.setAttribute('cy', `${annotation.data.y}%`);
@@ -267,10 +413,34 @@ class SyncManager {
             pin.setAttribute('data-id', annotation.id);
             pin.classList.add('annotation-pin');
             layer.appendChild(pin);
+        } else if (annotation.type === 'pen') {
+            // 描画中プレビューを確定版で置き換える
+            delete this.liveStrokes[annotation.id];
+            this.drawPenPath(annotation.id, decodePenPoints(annotation.data), annotation.data.color || 'red');
         }
         // TODO: 他の注釈タイプ実装
     }
     
+    drawPenPath(id, points, color) {
+        const layer = document.getElementById('annotation-layer');
+        let path = layer.querySelector(`[data-id="${id}"]`);
+        
+        if (!path) {
+            path = document.createElementNS('http://www.w3.org/2000/svg', 'path');
+            path.setAttribute('fill', 'none');
+            path.setAttribute('stroke', color);
+            path.setAttribute('stroke-width', '3');
+            path.setAttribute('stroke-linecap', 'round');
+            path.setAttribute('stroke-linejoin', 'round');
+            path.setAttribute('data-id', id);
+            path.classList.add('annotation-pen');
+            layer.appendChild(path);
+        }
+        
+        if (points.length < 2) return;
+        path.setAttribute('d', points.map((p, i) => `${i === 0 ? 'M' : 'L'} ${p.x}% ${p.y}%`).join(' '));
+    }
+    
     removeAnnotation(annotationId) {
         const element = document.querySelector(`[data-id="${annotationId}"]`);
         if (element) {
@@ -315,5 +485,33 @@ class SyncManager {
     }
 }
 
+/**
+ * ペン座標の復元 - サーバーは量子化済みuint16配列 (packed) で送信する
+ */
+function decodePenPoints(data) {
+    if (!data.packed) {
+        return data.points || [];
+    }
+    
+    let buffer = data.packed;
+    if (typeof buffer === 'string') {
+        // HTTP API経由ではbase64文字列
+        buffer = Uint8Array.from(atob(buffer), c => c.charCodeAt(0)).buffer;
+    } else if (ArrayBuffer.isView(buffer)) {
+        buffer = buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength);
+    }
+    
+    const view = new DataView(buffer);
+    const scale = data.scale || 100;
+    const points = [];
+    for (let offset = 0; offset + 3 < view.byteLength; offset += 4) {
+        points.push({
+            x: view.getUint16(offset, true) / scale,
+            y: view.getUint16(offset + 2, true) / scale
+        });
+    }
+    return points;
+}
+
 // グローバルインスタンス
 const sync = new SyncManager();
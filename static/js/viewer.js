@@ -26,6 +26,17 @@ class Viewer {
         this.panOffset = {x: 0, y: 0};
         
         this.initialized = false;
+        
+        // 先読み済みURL (同じ画像を二重に取得しない)
+        this.prefetched = new Set();
+        this.prefetchImages = [];
+        this.atlasFailed = false;
+        this.refreshTimer = null;
+        
+        // ページ詳細 (ノート・用語等) は表示したページの分だけ取得する
+        this.pageDetails = new Map();
+        // 変換が済んでおらず表示できていないページ
+        this.pendingPage = null;
     }
     
     init() {
@@ -55,13 +66,14 @@ class Viewer {
         
         try {
             console.log('教材読み込み開始:', materialId);
-            const response = await fetch(`/api/materials/${materialId}`);
+            const response = await fetch(`/api/materials/${materialId}/summary`);
             
             if (!response.ok) {
                 throw new Error(`HTTP ${response.status}: ${response.statusText}`);
             }
             
             this.materialData = await response.json();
+            this.pageDetails.clear();
             console.log('教材データ取得成功:', this.materialData);
             
             // UI更新
@@ -81,6 +93,9 @@ class Viewer {
             // 最初のページ表示
             this.goToPage(1);
             
+            // 変換中の教材は残りのページが揃うまで定期的に再取得
+            this.scheduleRefresh();
+            
             console.log('教材読み込み完了');
             return this.materialData;
             
@@ -91,7 +106,48 @@ class Viewer {
         }
     }
     
+    scheduleRefresh() {
+        clearTimeout(this.refreshTimer);
+        if (this.materialData.status !== 'converting') return;
+        
+        this.refreshTimer = setTimeout(() => this.refreshMaterial(), 5000);
+    }
+    
+    async refreshMaterial() {
+        try {
+            const response = await fetch(`/api/materials/${this.materialData.id}/summary`);
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            
+            const data = await response.json();
+            if (data.pages_ready !== this.materialData.pages_ready || data.status !== this.materialData.status) {
+                this.materialData = data;
+                this.renderThumbnails();
+                this.highlightThumbnail(this.currentPage);
+                if (this.pendingPage === this.currentPage) {
+                    this.renderCurrentPage();
+                }
+            }
+        } catch (error) {
+            console.warn('教材再取得エラー:', error);
+        }
+        
+        this.scheduleRefresh();
+    }
+    
+    highlightThumbnail(pageNumber) {
+        document.querySelectorAll('.thumbnail').forEach(thumb => {
+            const thumbPage = parseInt(thumb.dataset.page);
+            thumb.classList.toggle('active', thumbPage === pageNumber);
+        });
+    }
+    
     renderThumbnails() {
+        const atlas = this.materialData.thumbnail_atlas;
+        if (atlas && atlas.url && !this.atlasFailed) {
+            this.renderAtlasThumbnails(atlas);
+            return;
+        }
+        
         this.thumbnailsContainer.innerHTML = this.materialData.pages.map(page => `
             <div class="thumbnail ${page.page_number === 1 ? 'active' : ''}" 
                  data-page="${page.page_number}"
@@ -104,25 +160,63 @@ class Viewer {
         `).join('');
     }
     
-    goToPage(pageNumber) {
+    renderAtlasThumbnails(atlas) {
+        // スプライト1枚で全サムネイルを表示 (読み込み失敗時は個別画像に戻す)
+        const probe = new Image();
+        probe.onerror = () => {
+            console.warn('サムネイルスプライト読み込み失敗、個別画像を使用します');
+            this.atlasFailed = true;
+            this.renderThumbnails();
+        };
+        probe.src = atlas.url;
+        
+        const tiles = {};
+        atlas.tiles.forEach(tile => { tiles[tile.page_number] = tile; });
+        
+        this.thumbnailsContainer.innerHTML = this.materialData.pages.map(page => {
+            const tile = tiles[page.page_number];
+            if (!tile) {
+                return `
+            <div class="thumbnail" data-page="${page.page_number}"
+                 onclick="viewer.goToPage(${page.page_number})">
+                <img src="${page.thumbnail_url}" alt="ページ ${page.page_number}" class="w-full rounded shadow">
+                <p class="text-xs text-center mt-1">${page.page_number}</p>
+            </div>`;
+            }
+            
+            const sizeX = atlas.width / tile.width * 100;
+            const sizeY = atlas.height / tile.height * 100;
+            const posX = atlas.width === tile.width ? 0 : tile.x / (atlas.width - tile.width) * 100;
+            const posY = atlas.height === tile.height ? 0 : tile.y / (atlas.height - tile.height) * 100;
+            
+            return `
+            <div class="thumbnail ${page.page_number === 1 ? 'active' : ''}" 
+                 data-page="${page.page_number}"
+                 onclick="viewer.goToPage(${page.page_number})">
+                <div role="img" aria-label="ページ ${page.page_number}"
+                     class="w-full rounded shadow"
+                     style="aspect-ratio: ${tile.width} / ${tile.height};
+                            background-image: url('${atlas.url}');
+                            background-size: ${sizeX}% ${sizeY}%;
+                            background-position: ${posX}% ${posY}%;"></div>
+                <p class="text-xs text-center mt-1">${page.page_number}</p>
+            </div>`;
+        }).join('');
+    }
+    
+    goToPage(pageNumber, placeholder = null) {
         if (pageNumber < 1 || pageNumber > this.materialData.total_pages) {
             return;
         }
         
         this.currentPage = pageNumber;
-        const pageData = this.materialData.pages.find(p => p.page_number === pageNumber);
-        
-        if (!pageData) return;
         
         // 画像表示
-        this.pageImage.src = pageData.image_url;
+        this.renderCurrentPage(placeholder);
         this.currentPageEl.textContent = pageNumber;
         
         // サムネイルハイライト
-        document.querySelectorAll('.thumbnail').forEach(thumb => {
-            const thumbPage = parseInt(thumb.dataset.page);
-            thumb.classList.toggle('active', thumbPage === pageNumber);
-        });
+        this.highlightThumbnail(pageNumber);
         
         // リセット
         this.zoom = 1.0;
@@ -134,6 +228,110 @@ class Viewer {
         document.dispatchEvent(event);
     }
     
+    renderCurrentPage(placeholder = null) {
+        const pageData = this.materialData.pages.find(p => p.page_number === this.currentPage);
+        
+        // 変換が済んでいないページは変換中の表示にし、再取得で揃ったら差し替える
+        if (!pageData) {
+            this.pendingPage = this.currentPage;
+            this.pageImage.removeAttribute('src');
+            this.pageImage.classList.remove('placeholder');
+            this.pageImage.classList.add('pending');
+            this.pageImage.alt = `ページ ${this.currentPage} は変換中です`;
+            return;
+        }
+        
+        this.pendingPage = null;
+        this.pageImage.classList.remove('pending');
+        this.pageImage.alt = 'ページ画像';
+        
+        const detail = this.pageDetails.get(this.currentPage);
+        this.showPageImage(pageData.image_url, placeholder || (detail && detail.placeholder));
+    }
+    
+    async loadPageDetail(pageNumber) {
+        // ページ詳細を取得 (取得済みならキャッシュを返す)
+        if (this.pageDetails.has(pageNumber)) {
+            return this.pageDetails.get(pageNumber);
+        }
+        
+        try {
+            const response = await fetch(`/api/materials/${this.materialData.id}/pages/${pageNumber}`);
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            
+            const detail = await response.json();
+            this.pageDetails.set(pageNumber, detail);
+            return detail;
+        } catch (error) {
+            console.warn('ページ詳細取得エラー:', error);
+            return null;
+        }
+    }
+    
+    prefetch(hints) {
+        // サーバーからの先読みヒントに従い後続ページ画像をキャッシュに載せる
+        if (!hints) return;
+        
+        hints.forEach(hint => {
+            [hint.image_url, hint.thumbnail_url].forEach(url => {
+                if (!url || this.prefetched.has(url)) return;
+                this.prefetched.add(url);
+                
+                const img = new Image();
+                img.decoding = 'async';
+                img.onload = img.onerror = () => {
+                    this.prefetchImages = this.prefetchImages.filter(i => i !== img);
+                };
+                img.src = url;
+                this.prefetchImages.push(img);
+            });
+        });
+    }
+    
+    async preloadDeck() {
+        // 講義前に教材全体の画像を空き時間に1枚ずつ取得してキャッシュに載せる
+        try {
+            const response = await fetch(`/api/materials/${this.materialData.id}/precache`);
+            if (!response.ok) return;
+            
+            const precache = await response.json();
+            const idle = window.requestIdleCallback || ((cb) => setTimeout(cb, 200));
+            
+            for (const asset of precache.assets) {
+                if (this.prefetched.has(asset.url)) continue;
+                this.prefetched.add(asset.url);
+                
+                await new Promise(resolve => idle(resolve));
+                await fetch(asset.url, {priority: 'low'}).catch(() => {});
+            }
+        } catch (error) {
+            console.warn('教材の事前取得エラー:', error);
+        }
+    }
+    
+    showPageImage(url, placeholder) {
+        // 先読み済みならそのまま表示
+        if (!placeholder || this.prefetched.has(url)) {
+            this.pageImage.classList.remove('placeholder');
+            this.pageImage.src = url;
+            return;
+        }
+        
+        // プレースホルダーをぼかして即表示し、本画像が届いたら差し替える
+        this.pageImage.classList.add('placeholder');
+        this.pageImage.src = placeholder;
+        
+        const full = new Image();
+        full.onload = () => {
+            if (this.pageImage.src === placeholder) {
+                this.pageImage.src = url;
+                this.pageImage.classList.remove('placeholder');
+            }
+        };
+        full.src = url;
+        this.prefetched.add(url);
+    }
+    
     nextPage() {
         this.goToPage(this.currentPage + 1);
     }
@@ -215,7 +413,8 @@ class Viewer {
     }
     
     getCurrentPage() {
-        return this.materialData.pages.find(p => p.page_number === this.currentPage);
+        return this.pageDetails.get(this.currentPage) ||
+            this.materialData.pages.find(p => p.page_number === this.currentPage);
     }
 }
 
@@ -47,7 +47,10 @@ export type RectData = {
 
 export type PenData = {
   type: 'pen';
-  points: Point[];
+  points?: Point[]; // 送信時のみ。サーバーはpackedに変換して保持・配信する
+  packed?: ArrayBuffer; // 量子化済み座標 (uint16 LE, x/y交互)
+  point_count?: number;
+  scale?: number; // 量子化倍率 (座標 = 値 / scale)
   strokeWidth: number;
   smoothing?: boolean;
 };
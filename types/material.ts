@@ -33,6 +33,7 @@ export type Page = {
   pageNumber: number; // 1-indexed
   imageUrl: string; // /materials/{materialId}/pages/{pageNumber}.png
   thumbnailUrl: string; // /materials/{materialId}/thumbnails/{pageNumber}.png
+  placeholder?: string; // 低画質プレースホルダー (data URI)
   instructorNotes: InstructorNote[];
   glossary: GlossaryTerm[];
   checklist: CheckItem[];
@@ -86,3 +87,46 @@ export type PageMetadata = {
   checklist: CheckItem[];
   highlights: Highlight[];
 };
+
+// ページ変更時にサーバーが送る先読みヒント
+export type PrefetchHint = {
+  page_number: number;
+  image_url: string;
+  thumbnail_url: string;
+};
+
+// サムネイルスプライト (metadata.json の thumbnail_atlas)
+export type ThumbnailAtlas = {
+  url: string;
+  width: number;
+  height: number;
+  tiles: { page_number: number; x: number; y: number; width: number; height: number }[];
+};
+
+// 教材要約 (/api/materials/{id}/summary) ページ詳細は /api/materials/{id}/pages/{n}
+export type MaterialSummary = {
+  id: string;
+  title: string;
+  category: string;
+  status?: 'converting' | 'ready';
+  total_pages: number;
+  pages_ready?: number;
+  thumbnail_atlas?: ThumbnailAtlas;
+  pages: PrefetchHint[];
+};
+
+// 事前キャッシュ用マニフェスト (/api/materials/{id}/precache)
+// bundle.url はRangeリクエスト対応の無圧縮zip (初回リクエストで生成、中のパスはアセットURLから先頭の/を除いたもの)
+export type PrecacheManifest = {
+  material_id: string;
+  revision: string;
+  bundle: { url: string };
+  total_size: number;
+  assets: {
+    url: string;
+    sha256: string;
+    size: number;
+    page_number: number | null;
+    kind: 'page' | 'thumbnail' | 'atlas';
+  }[];
+};
@@ -28,8 +28,10 @@ export type RoomState = {
   currentPage: number;
   syncEnabled: boolean;
   annotations: Annotation[];
-  participants: Participant[];
+  participantCount: number;
+  participants?: Participant[]; // 講師にのみ送られる
   importantPoint: ImportantPoint | null;
+  seq: number; // この状態に反映済みの配信連番 (以下のpage:changed・annotation:addedは重複)
 };
 
 export type ImportantPoint = {
@@ -1,28 +1,43 @@
 import type { Annotation } from './annotation';
 import type { Participant, RoomState, ImportantPoint } from './room';
+import type { PrefetchHint } from './material';
 
 // Server -> Client events
 export type ServerToClientEvents = {
   // Page synchronization
-  'page:changed': (data: { pageNumber: number; timestamp: number }) => void;
+  'page:changed': (data: { pageNumber: number; timestamp: number; placeholder?: string; prefetch?: PrefetchHint[] } & DeliveryStamp) => void;
 
   // Sync control
   'sync:toggled': (data: { enabled: boolean }) => void;
 
   // Annotations
-  'annotation:added': (annotation: Annotation) => void;
+  'annotation:added': (annotation: Annotation & DeliveryStamp) => void;
   'annotation:removed': (data: { id: string }) => void;
   'annotation:cleared': (data: { pageNumber?: number }) => void;
 
+  // Pen stroke streaming (finalized stroke arrives as 'annotation:added' with the same id)
+  'stroke:started': (data: { stroke_id: string; page_number: number; data: Record<string, unknown> }) => void;
+  'stroke:points': (data: { stroke_id: string; seq: number; packed: ArrayBuffer; scale: number }) => void;
+  'stroke:aborted': (data: { stroke_id: string }) => void;
+
   // Important points display
   'important:show': (data: ImportantPoint) => void;
   'important:hide': () => void;
 
   // Participants
-  'participant:joined': (participant: Participant) => void;
-  'participant:left': (data: { id: string; socketId: string }) => void;
+  // 入退室はサーバー側でまとめて送る (差分は講師のみ、人数は全員)
+  'presence:delta': (data: { joined: Participant[]; left: string[]; count: number }) => void;
+  'presence:count': (data: { count: number }) => void;
   'participant:updated': (participant: Participant) => void;
 
+  // 送信キューが溜まった接続への描画中ストローク配信の停止/再開
+  'sync:downgraded': (data: { live: boolean }) => void;
+
+  // Lecture replay (要求した接続にのみ送られる)
+  'replay:state': (data: { room_id: string; t: number; end: number; state: ReplayState }) => void;
+  'replay:event': (data: { t: number; event: string; data: Record<string, unknown> }) => void;
+  'replay:ended': (data: { t: number }) => void;
+
   // Room state (for reconnection)
   'room:state': (state: RoomState) => void;
   'room:error': (data: { message: string }) => void;
@@ -54,12 +69,48 @@ export type ClientToServerEvents = {
   'annotation:remove': (data: { id: string }) => void;
   'annotation:clear': (data: { pageNumber?: number }) => void;
 
+  // Pen stroke streaming (instructor only)
+  'stroke:begin': (data: { stroke_id: string; page_number: number; data: Record<string, unknown> }) => void;
+  'stroke:append': (data: { stroke_id: string; seq: number; points: [number, number][] }) => void;
+  'stroke:end': (data: { stroke_id: string }) => void;
+
   // Important points (instructor only)
   'important:display': (data: Omit<ImportantPoint, 'id' | 'displayedAt'>) => void;
   'important:dismiss': () => void;
 
   // Participant updates
   'participant:update-page': (data: { pageNumber: number }) => void;
+
+  // Latency telemetry (時計合わせはackでサーバー時刻を受け取る)
+  'latency:ping': (data: { client_ts: number }, ack: (res: { client_ts: number; server_ts: number }) => void) => void;
+  'latency:report': (data: { room_id: string; samples: LatencySample[] }) => void;
+
+  // Lecture replay (t: エポックms、省略時は記録の先頭から)
+  'replay:start': (data: { room_id: string; t?: number; speed?: number }) => void;
+  'replay:stop': () => void;
+};
+
+// 講義記録のシーク結果
+export type ReplayState = {
+  current_page: number;
+  sync_enabled: boolean;
+  annotations: Annotation[];
+  important: { title: string; points: string[] } | null;
+};
+
+// 遅延計測用に配信イベントへ付くサーバー時刻 (エポックms) とルーム内連番
+export type DeliveryStamp = {
+  server_ts: number;
+  seq: number;
+};
+
+// クライアントが報告する計測値 (時刻はサーバー時刻に補正済み)
+export type LatencySample = {
+  event: 'page:changed' | 'annotation:added';
+  seq: number;
+  server_ts: number;
+  received_at: number;
+  rendered_at: number;
 };
 
 // Socket data stored in socket.data